@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import deque
+
+# Processing rate of the acquisition thread, the same as the render loop
+acquisition_interval = 1/60
+
+
+class Frame:
+    def __init__(self, impedance, wave, fft, timestamp=None):
+        self.impedance = impedance
+        self.wave = wave
+        self.fft = fft
+        # Board timestamp of the newest sample in the frame
+        self.timestamp = timestamp
+
+
+class FrameQueue:
+    """
+    Bounded queue between the acquisition thread and the GUI.
+    When it is full the oldest frame is discarded and counted as dropped.
+    """
+    def __init__(self, size=1):
+        self.frames = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.lock:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.published += 1
+
+    def get_latest(self):
+        with self.lock:
+            if len(self.frames) == 0:
+                return None
+            # Frames older than the newest one will never be shown
+            self.dropped += len(self.frames)-1
+            frame = self.frames.pop()
+            self.frames.clear()
+            return frame
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+
+
+class AcquisitionWorker(threading.Thread):
+    """ Reads and processes data from the data source independently of the GUI """
+    def __init__(self, data_processing, frames, interval=acquisition_interval):
+        super().__init__(daemon=True)
+        self.data_processing = data_processing
+        self.frames = frames
+        self.interval = interval
+        self.finished = False
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            start_time = time.perf_counter()
+            if self.data_processing.data_source.is_finished():
+                self.finished = True
+                break
+
+            impedance, wave, fft = self.data_processing.forward()
+            if impedance is not None or wave is not None or fft is not None:
+                self.frames.put(Frame(impedance, wave, fft, self.data_processing.timestamp))
+
+            # An unthrottled clock is processed as fast as possible
+            if self.data_processing.clock.throttled:
+                elapsed = time.perf_counter()-start_time
+                self.stop_event.wait(max(0.0, self.interval-elapsed))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
@@ -0,0 +1,31 @@
+import numpy as np
+
+# Frequency bands in Hz, from the lower (included) to the upper (excluded) frequency
+default_bands = {
+    "delta": (1.0, 4.0),
+    "theta": (4.0, 8.0),
+    "alpha": (8.0, 13.0),
+    "beta": (13.0, 30.0),
+    "gamma": (30.0, 45.0)
+}
+
+
+class BandPower:
+    """
+    Power of the frequency bands of all the channels at once: the spectrum of
+    shape (channels, bins) is multiplied by a (bins, bands) matrix holding the
+    width of the bins that fall in each band.
+    """
+    def __init__(self, freq, bands=None):
+        if bands is None:
+            bands = default_bands
+        self.names = list(bands.keys())
+        freq = np.asarray(freq)
+        bin_width = freq[1]-freq[0]
+        self.weights = np.zeros((len(freq), len(bands)))
+        for i, (low, high) in enumerate(bands.values()):
+            self.weights[(freq >= low) & (freq < high), i] = bin_width
+
+    def compute(self, power):
+        """ Powers of shape (channels, bands) of the PSD `power` of shape (channels, bins) """
+        return np.asarray(power) @ self.weights
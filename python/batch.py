@@ -0,0 +1,192 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+
+from clock import SteppedClock
+from data_processing import DataProcessing, fft_output, impedance_output, band_power_output
+from headless import FeatureSummary
+from log_manager import csv_format, binary_format, export_csv, is_binary_record
+from playback import PlaybackManager
+
+# Name of the aggregate table written in the output directory
+summary_file_name = "summary.csv"
+
+
+def find_recordings(root):
+    """ Records written by DataLogger under `root` (N.csv or N.bin), sorted by path """
+    recordings = []
+    for folder, _, files in os.walk(root):
+        for file_name in files:
+            name, extension = os.path.splitext(file_name)
+            if name.isdigit() and extension[1:] in (csv_format, binary_format):
+                recordings.append(os.path.join(folder, file_name))
+    return sorted(recordings)
+
+
+def analyze_recording(path, dtype=np.float64):
+    """
+    Runs the filter, spectrum, band power and impedance stages over a whole
+    record as fast as possible, one spectrum hop at a time. Returns the summary
+    of the record.
+    """
+    # The input tree is only read, CSV records are parsed in memory without the cache files
+    data_source = PlaybackManager(path, cache=False)
+    if data_source.parser.data is None:
+        raise ValueError("not a valid record")
+
+    data_processing = DataProcessing(data_source, save_logs=False, dtype=dtype)
+    data_processing.set_outputs({fft_output, impedance_output, band_power_output})
+    data_processing.start()
+    data_processing.set_clock(SteppedClock(data_processing.spectrum.hop_samples))
+    summary = FeatureSummary(len(data_processing.exg_channels))
+    band_power_sum = None
+    band_power_count = 0
+
+    start_time = time.perf_counter()
+    while not data_source.is_finished():
+        impedance, _, fft = data_processing.forward()
+        summary.update(impedance, fft)
+        for _, powers in data_processing.get_band_powers():
+            band_power_sum = powers if band_power_sum is None else band_power_sum+powers
+            band_power_count += 1
+    elapsed = time.perf_counter()-start_time
+
+    length = data_source.get_length()
+    result = summary.to_dict()
+    result.update({
+        "file": path,
+        "board_id": data_source.board_id,
+        "samples": length,
+        "duration": length/data_processing.sampling_rate,
+        "processing_time": elapsed
+    })
+    if band_power_count > 0:
+        result["bands"] = data_processing.band_power.names
+        result["mean_band_power"] = (band_power_sum/band_power_count).tolist()
+    data_processing.stop()
+    data_processing.close()
+    return result
+
+
+def analyze_task(path, output, root, dtype):
+    # Runs in a worker process, every error is reported in the summary of the file
+    try:
+        result = analyze_recording(path, dtype)
+    except Exception as e:
+        return {"file": path, "error": str(e)}
+    # N_features.json, in the same folder of the record relative to the output directory
+    name = os.path.splitext(os.path.relpath(path, root))[0]
+    feature_path = os.path.join(output, f"{name}_features.json")
+    os.makedirs(os.path.dirname(feature_path), exist_ok=True)
+    with open(feature_path, 'w') as file:
+        json.dump(result, file)
+    return result
+
+
+def export_task(path, output, root):
+    # N.csv in the same folder of the binary record relative to the output directory
+    csv_path = os.path.join(output, os.path.splitext(os.path.relpath(path, root))[0]+".csv")
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    try:
+        export_csv(path, csv_path)
+    except Exception as e:
+        return {"file": path, "error": str(e)}
+    return {"file": path, "csv": csv_path}
+
+
+def export_records(recordings, output, root, workers):
+    """ Converts the binary records into CSV files, returns the number of failures """
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = [executor.submit(export_task, path, output, root) for path in recordings]
+        for i, task in enumerate(as_completed(tasks)):
+            result = task.result()
+            failed += "error" in result
+            status = f"error: {result['error']}" if "error" in result else result["csv"]
+            print(f"[{i+1}/{len(recordings)}] {os.path.relpath(result['file'], root)}: {status}")
+    return failed
+
+
+def write_summary(results, path):
+    """ One row per record with the averages over its channels """
+    bands = []
+    for result in results:
+        for band in result.get("bands", []):
+            if band not in bands:
+                bands.append(band)
+
+    with open(path, 'w', newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["File", "Board", "Channels", "Duration (s)", "Processing time (s)", "Mean impedance (ohm)"] +
+                        [f"Mean {band} power" for band in bands] + ["Error"])
+        for result in results:
+            if "error" in result:
+                writer.writerow([result["file"]]+[""]*(5+len(bands))+[result["error"]])
+                continue
+            impedance = result.get("mean_impedance")
+            power = {}
+            if "mean_band_power" in result:
+                # Channels turned off during the record have no power
+                means = np.nanmean(np.array(result["mean_band_power"], dtype=float), axis=0)
+                power = dict(zip(result["bands"], means))
+            writer.writerow([result["file"], result["board_id"], len(result["channels"]),
+                             f"{result['duration']:.1f}", f"{result['processing_time']:.2f}",
+                             "" if impedance is None else f"{np.mean(impedance):.0f}"] +
+                            [f"{power[band]:.6g}" if band in power else "" for band in bands] + [""])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyses every record of a directory tree, without the GUI.")
+    parser.add_argument("input", help="directory containing the session folders")
+    parser.add_argument("--output", default=None,
+                        help="directory of the feature files and of summary.csv (default: the input directory)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes analysing records in parallel (default: one per CPU)")
+    parser.add_argument("--float32", action="store_true", help="process in single precision")
+    parser.add_argument("--export-csv", action="store_true",
+                        help="convert the binary records (N.bin) into CSV files instead of analysing them")
+    return parser.parse_args()
+
+
+def run(args):
+    recordings = find_recordings(args.input)
+    if args.export_csv:
+        recordings = [path for path in recordings if is_binary_record(path)]
+    if len(recordings) == 0:
+        print(f"No records found in {args.input}")
+        return 1
+    output = args.input if args.output is None else args.output
+    os.makedirs(output, exist_ok=True)
+    if args.export_csv:
+        failed = export_records(recordings, output, args.input, max(1, args.workers))
+        print(f"Exported {len(recordings)-failed} records{f', {failed} failed' if failed > 0 else ''}")
+        return 0 if failed == 0 else 1
+    dtype = np.float32 if args.float32 else np.float64
+    BoardShim.disable_board_logger()
+
+    results = []
+    start_time = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        tasks = [executor.submit(analyze_task, path, output, args.input, dtype) for path in recordings]
+        for task in as_completed(tasks):
+            result = task.result()
+            results.append(result)
+            status = f"error: {result['error']}" if "error" in result else f"{result['duration']:.0f} s of signal"
+            print(f"[{len(results)}/{len(recordings)}] {os.path.relpath(result['file'], args.input)}: {status}")
+
+    results.sort(key=lambda result: result["file"])
+    write_summary(results, os.path.join(output, summary_file_name))
+    failed = sum("error" in result for result in results)
+    print(f"Analysed {len(results)-failed} records in {time.monotonic()-start_time:.1f} s"
+          f"{f', {failed} failed' if failed > 0 else ''}, summary in {os.path.join(output, summary_file_name)}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    exit(run(parse_args()))
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from brainflow import BoardIds
+from brainflow.board_shim import BoardShim, BrainFlowInputParams
+
+from board import exg_channels
+from data_processing import DataProcessing
+from data_source import DataSource
+from function import Function
+from log_manager import DataLogger, LogParser, csv_format, binary_format
+from playback import PlaybackManager
+
+record_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "record")
+record_files = ["openbci_test.csv", "self_test.csv"]
+channel_counts = [8, 16]
+window_sizes = [2, 4, 8]
+dtypes = {"float64": np.float64, "float32": np.float32}
+frame_rate = 60
+
+
+class ArrayDataSource(DataSource):
+    """
+    Replays samples captured in memory, restarting from the beginning when they are over.
+    With `num_channels` only the first EXG channels are exposed, as on a board with fewer channels.
+    """
+    def __init__(self, board_id, data, num_channels=None):
+        super().__init__()
+        self.board_id = board_id
+        self.data = data
+        self.position = 0
+        self.num_channels = num_channels
+
+    def get_exg_channels(self):
+        return super().get_exg_channels()[:self.num_channels]
+
+    def read_data(self, samples=1):
+        if self.position+samples > len(self.data):
+            self.position = 0
+        data = self.data[self.position:self.position+samples]
+        self.position += samples
+        return data
+
+    def is_finished(self):
+        return False
+
+
+class RecordDataSource(PlaybackManager):
+    """ Playback of a record exposing only its first `num_channels` EXG channels """
+    def __init__(self, file_path, num_channels=None):
+        super().__init__(file_path)
+        self.num_channels = num_channels
+
+    def get_exg_channels(self):
+        return super().get_exg_channels()[:self.num_channels]
+
+
+def capture_synthetic_data(seconds):
+    board_id = BoardIds.SYNTHETIC_BOARD.value
+    board = BoardShim(board_id, BrainFlowInputParams())
+    board.prepare_session()
+    board.start_stream()
+    time.sleep(seconds)
+    data = board.get_board_data()
+    board.stop_stream()
+    board.release_session()
+    return board_id, np.transpose(data)
+
+
+def run_frames(fn, frames):
+    latencies = []
+    for i in range(frames):
+        start_time = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter()-start_time)
+    return latencies
+
+
+def measure(name, params, setup, frames, samples_per_frame):
+    """ Times `frames` calls of the function returned by `setup`, then measures its peak memory """
+    fn, teardown = setup()
+    latencies = run_frames(fn, frames)
+    teardown()
+
+    fn, teardown = setup()
+    tracemalloc.start()
+    run_frames(fn, min(frames, 100))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    teardown()
+
+    latencies = np.array(latencies)*1000
+    result = {
+        "name": name,
+        "params": params,
+        "frames": frames,
+        "latency_ms": {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(np.max(latencies))
+        },
+        "samples_per_sec": samples_per_frame*frames/(np.sum(latencies)/1000),
+        "peak_memory_kib": peak_memory/1024
+    }
+    print(f"{name:<16} {json.dumps(params):<60} p50 {result['latency_ms']['p50']:8.3f} ms"
+          f"   p95 {result['latency_ms']['p95']:8.3f} ms   {result['samples_per_sec']:12.0f} samples/s")
+    return result
+
+
+def forward_setup(source_factory, channels, window_size, dtype=np.float64):
+    def setup():
+        # The filters, buffer and spectrum are sized for the channels of the source
+        data_processing = DataProcessing(source_factory(channels), save_logs=False, dtype=dtype)
+        data_processing.window_size = window_size
+        data_processing.start()
+        samples = samples_per_frame(data_processing.sampling_rate)
+
+        def fn():
+            if data_processing.data_source.is_finished():
+                data_processing.data_source.seek(0)
+            data_processing.process_samples(samples)
+        return fn, data_processing.stop
+    return setup
+
+
+def logger_setup(record_format, board_id, data, samples, background=True):
+    """ With background=False the chunks are written directly, as done by the record writer thread """
+    class Recorder:
+        pass
+
+    def setup():
+        folder = tempfile.mkdtemp()
+        logger = DataLogger(folder, record_format=record_format)
+        recorder = Recorder()
+        recorder.board_id = board_id
+        logger.create_new_record(recorder, exg_channels)
+        source = ArrayDataSource(board_id, data)
+
+        def teardown():
+            logger.close()
+            shutil.rmtree(folder, ignore_errors=True)
+        if background:
+            return lambda: logger.write_data(source.read_data(samples)), teardown
+        return lambda: logger.write_chunks([source.read_data(samples)]), teardown
+    return setup
+
+
+def parser_setup(path, samples):
+    def setup():
+        parser = LogParser(path)
+
+        def fn():
+            if not parser.has_new_data:
+                parser.begin()
+            parser.read_data(samples)
+        return fn, parser.close
+    return setup
+
+
+def graph_setup(channels, window_size, sampling_rate):
+    from graph import Graph
+
+    def setup():
+        graph = Graph()
+        graph.resize(800, 400)
+        graph.show()
+        for ch in range(channels):
+            graph.addPlot((255, 255, 255))
+        num_points = window_size*sampling_rate
+        x = np.linspace(-window_size, 0, num_points)
+        data = [Function(x, np.random.normal(size=num_points)) for _ in range(channels)]
+        return lambda: graph.refresh(data), graph.close
+    return setup
+
+
+def samples_per_frame(sampling_rate):
+    return max(1, sampling_rate//frame_rate)
+
+
+def run_benchmarks(args):
+    results = []
+    sources = {}
+    board_id, synthetic_data = capture_synthetic_data(args.synthetic_seconds)
+    sources["synthetic"] = (board_id, lambda channels: ArrayDataSource(board_id, synthetic_data, channels))
+    for file_name in record_files:
+        path = os.path.join(record_folder, file_name)
+        sources[file_name] = (LogParser(path).board_id, lambda channels, path=path: RecordDataSource(path, channels))
+
+    # DataProcessing.forward()
+    for source_name, (source_board_id, factory) in sources.items():
+        sampling_rate = BoardShim.get_sampling_rate(source_board_id)
+        for channels in channel_counts:
+            for window_size in window_sizes:
+                for dtype_name, dtype in dtypes.items():
+                    params = {"source": source_name, "channels": channels, "window_size": window_size, "dtype": dtype_name}
+                    setup = forward_setup(factory, channels, window_size, dtype)
+                    results.append(measure("forward", params, setup, args.frames, samples_per_frame(sampling_rate)))
+
+    # DataLogger.write_data(), with the samples of a recorded board
+    record_parser = LogParser(os.path.join(record_folder, record_files[0]))
+    sampling_rate = BoardShim.get_sampling_rate(record_parser.board_id)
+    samples = samples_per_frame(sampling_rate)
+    for record_format in [csv_format, binary_format]:
+        params = {"source": record_files[0], "format": record_format}
+        data = np.array(record_parser.data)
+        setup = logger_setup(record_format, record_parser.board_id, data, samples)
+        results.append(measure("write_data", params, setup, args.frames, samples))
+        setup = logger_setup(record_format, record_parser.board_id, data, samples, background=False)
+        results.append(measure("write_chunks", params, setup, args.frames, samples))
+    record_parser.close()
+
+    # LogParser.read_data()
+    for file_name in record_files:
+        path = os.path.join(record_folder, file_name)
+        for samples in [1, 8, 64]:
+            params = {"source": file_name, "rows": samples}
+            results.append(measure("read_data", params, parser_setup(path, samples), args.frames, samples))
+
+    # Graph.refresh()
+    if not args.skip_graph:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication([])
+        for channels in channel_counts:
+            for window_size in window_sizes:
+                params = {"channels": channels, "window_size": window_size}
+                setup = graph_setup(channels, window_size, sampling_rate)
+                results.append(measure("refresh", params, setup, args.frames, samples))
+        app.quit()
+    return results
+
+
+def check_precision(path):
+    """ Largest differences of the float32 processing from the float64 one over a whole recording """
+    processors = []
+    for dtype in [np.float64, np.float32]:
+        data_processing = DataProcessing(PlaybackManager(path), save_logs=False, dtype=dtype)
+        data_processing.start()
+        processors.append(data_processing)
+    sampling_rate = processors[0].sampling_rate
+    samples = samples_per_frame(sampling_rate)
+
+    wave_error = 0.0
+    psd_error = 0.0
+    while not processors[0].data_source.is_finished():
+        outputs = []
+        for data_processing in processors:
+            outputs.append(data_processing.process_samples(samples))
+        (_, wave64, fft64), (_, wave32, fft32) = outputs
+        if processors[0].buffer.written < processors[0].num_points:
+            continue
+
+        # Wave error relative to the peak amplitude of each channel
+        wave64 = np.array([f.y for f in wave64])
+        wave32 = np.array([f.y for f in wave32], dtype=np.float64)
+        peak = np.maximum(np.max(np.abs(wave64), axis=1, keepdims=True), np.finfo(np.float64).tiny)
+        wave_error = max(wave_error, float(np.max(np.abs(wave32-wave64)/peak)))
+
+        # Spectrum error in dB, on the bins within 80 dB of the channel peak and 30 dB above the
+        # rounding noise of single precision samples (railed channels are mostly below it)
+        psd64 = np.array([f.y for f in fft64])
+        psd32 = np.array([f.y for f in fft32], dtype=np.float64)
+        step = np.finfo(np.float32).eps*np.max(np.abs(wave64-processors[1].offset[:, np.newaxis]), axis=1, keepdims=True)
+        valid = (psd64 > np.max(psd64, axis=1, keepdims=True)*1e-8) & (psd64 > 1000*step**2/(6*sampling_rate))
+        # The mean is removed, the DC bin has no signal
+        valid[:, 0] = False
+        if np.any(valid):
+            psd_error = max(psd_error, float(np.max(np.abs(10*np.log10(psd32[valid]/psd64[valid])))))
+
+    for data_processing in processors:
+        data_processing.stop()
+    result = {"source": os.path.basename(path), "wave_relative_error": wave_error, "psd_error_db": psd_error}
+    print(f"{result['source']:<20} wave error {wave_error:.2e} (relative to peak)   PSD error {psd_error:.2e} dB")
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    previous = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in baseline["results"]}
+    print("\nComparison with", baseline_path, "(p50 latency, new/old)")
+    for result in results:
+        old = previous.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old is not None:
+            ratio = result["latency_ms"]["p50"]/old["latency_ms"]["p50"]
+            print(f"{result['name']:<16} {json.dumps(result['params']):<60} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the processing, recording, playback and plotting hot paths.")
+    parser.add_argument("--frames", type=int, default=600, help="frames measured by each benchmark (default: 600)")
+    parser.add_argument("--synthetic-seconds", type=float, default=5, help="seconds of synthetic board data to capture")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file where results are saved")
+    parser.add_argument("--compare", default=None, help="previous results JSON to compare with")
+    parser.add_argument("--skip-graph", action="store_true", help="do not benchmark Graph.refresh() (no PyQt needed)")
+    parser.add_argument("--precision", action="store_true",
+                        help="only compare the float32 processing with the float64 one on the recordings")
+    args = parser.parse_args()
+
+    BoardShim.disable_board_logger()
+    report = {
+        "date": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__
+    }
+    if args.precision:
+        report["precision"] = [check_precision(os.path.join(record_folder, file_name)) for file_name in record_files]
+    else:
+        report["results"] = run_benchmarks(args)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print("\nResults saved in", args.output)
+    if args.compare is not None and not args.precision:
+        compare(report["results"], args.compare)
+
+
+if __name__ == "__main__":
+    main()
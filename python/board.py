@@ -1,9 +1,8 @@
-import threading
-
 import numpy as np
 
 from brainflow.board_shim import BrainFlowInputParams, BoardShim, BrainFlowError
-from log_manager import DataLogger
+from log_manager import DataLogger, csv_format, binary_dtype
+from command_queue import CommandQueue
 from data_source import DataSource
 
 # Global variables
@@ -19,12 +18,20 @@ channel_ids = ['1', '2', '3', '4', '5', '6', '7', '8', 'Q', 'W', 'E', 'R', 'T',
 turn_off_commands = ['1', '2', '3', '4', '5', '6', '7', '8', 'q', 'w', 'e', 'r', 't', 'y', 'u', 'i']
 turn_on_commands = ['!', '@', '#', '$', '%', '^', '&', '*', 'Q', 'W', 'E', 'R', 'T', 'Y', 'U', 'I']
 
+# Channels of the largest supported board, the GUI has a row for each of them
 exg_channels = range(1, 17)
 ecg_channels = range(9, 12)
 
 
+def get_ecg_channels(num_channels):
+    # ECG electrodes are connected to channels 9-11, smaller boards have none
+    if num_channels < ecg_channels[-1]:
+        return range(0)
+    return ecg_channels
+
+
 class Board(DataSource):
-    def __init__(self, board_type, port, output_folder):
+    def __init__(self, board_type, port, output_folder, record_format=csv_format, record_dtype=binary_dtype):
         super().__init__()
 
         # Initialize board object
@@ -32,21 +39,26 @@ class Board(DataSource):
         params.serial_port = port
         self.board = BoardShim(board_type, params)
         self.board_id = self.board.get_board_id()
+        self.timestamp_channel = BoardShim.get_timestamp_channel(self.board_id)
 
         # Start streaming session
         try:
             print("Preparo la sessione...")
             self.board.prepare_session()
-            self.logger = DataLogger(output_folder)
+            self.logger = DataLogger(output_folder, record_format=record_format, record_dtype=record_dtype)
         except BrainFlowError:
             raise
 
+        # Commands are sent to the board in order by a single thread
+        self.commands = CommandQueue(self.config_board)
+        self.commands.start()
+
     def start(self, save_logs=True):
         if not self.streaming:
             print("Starting stream...")
             self.board.start_stream()
             if save_logs:
-                self.logger.create_new_record(self, exg_channels)
+                self.logger.create_new_record(self, self.get_exg_channels())
             super().start()
 
     def stop(self):
@@ -57,44 +69,62 @@ class Board(DataSource):
             super().stop()
 
     def close(self):
+        self.commands.close()
         self.board.release_session()
 
     def read_data(self, samples=1):
         try:
             data = self.board.get_board_data(samples)
+            timestamps = np.array(data[self.timestamp_channel])
             data = np.multiply(data, scale_factor)
+            # Timestamps are kept in seconds since the epoch
+            data[self.timestamp_channel] = timestamps
             data = np.transpose(data)
             self.logger.write_data(data)
             return data
         except BrainFlowError:
             return np.array([])
 
+    def get_backlog(self):
+        try:
+            return self.board.get_board_data_count()
+        except BrainFlowError:
+            return 0
+
     def toggle_impedance_checking(self, channel, active):
         if channel is None:
-            return
+            return None
 
         n = 1 if active else 0
         full_command = f"x{channel_ids[channel-1]}0{(1-n)*6}0{n}00X"
         full_command += f"z{channel_ids[channel-1]}0{n}Z"
-        self.send_command(full_command)
+        return self.send_command(full_command, ("impedance", channel))
 
     def toggle_channel(self, channel, active):
         if active:
             command = turn_on_commands[channel-1]
         else:
             command = turn_off_commands[channel-1]
+        return self.send_command(command, ("channel", channel))
 
-        thread = threading.Thread(target=self.send_command, args=(command,))
-        thread.start()
+    def send_command(self, command, key=None):
+        """
+        Queues a command for the board and returns a future with its response.
+        A pending command with the same key is replaced.
+        """
+        return self.commands.submit(command, key)
 
-    def send_command(self, command):
+    def config_board(self, command):
+        # Called by the command queue thread
         try:
-            self.board.config_board(command)
+            response = self.board.config_board(command)
             print(f"Sent command: {command}")
+            return response
         except BrainFlowError:
             print(f"Sending command {command} failed!")
+            raise
         except UnicodeDecodeError:
-            pass
+            return None
 
     def is_finished(self):
         return False
@@ -0,0 +1,66 @@
+import time
+
+# Seconds of samples processed at each call by the unthrottled clock
+unthrottled_block = 0.125
+
+
+class WallClock:
+    """
+    Real time: every call returns the samples acquired since the previous one
+    at the sampling rate. Live sessions always use it.
+    """
+    def __init__(self):
+        # The acquisition loop waits between two calls
+        self.throttled = True
+        self.speed = 1
+        self.prev_time = None
+        self.unprocessed_time = 0
+
+    def reset(self):
+        self.prev_time = None
+        self.unprocessed_time = 0
+
+    def get_samples(self, sampling_rate):
+        if self.prev_time is None:
+            self.unprocessed_time = 0
+            self.prev_time = time.monotonic()
+            return 0
+
+        curr_time = time.monotonic()
+        self.unprocessed_time += curr_time-self.prev_time
+        self.prev_time = curr_time
+        time_per_sample = 1/(sampling_rate*self.speed)
+        samples = int(self.unprocessed_time/time_per_sample)
+        self.unprocessed_time -= samples*time_per_sample
+        return samples
+
+
+class ScaledClock(WallClock):
+    """ Real time multiplied by `speed`, for the playback speed control """
+    def __init__(self, speed=1):
+        super().__init__()
+        self.speed = speed
+
+
+class SteppedClock:
+    """ A fixed number of samples at every call, independent of the time """
+    def __init__(self, samples):
+        self.throttled = True
+        self.samples = samples
+
+    def reset(self):
+        pass
+
+    def get_samples(self, sampling_rate):
+        return self.samples
+
+
+class UnthrottledClock(SteppedClock):
+    """ Blocks of `block` seconds of samples, processed one after the other without waiting """
+    def __init__(self, block=unthrottled_block):
+        super().__init__(None)
+        self.throttled = False
+        self.block = block
+
+    def get_samples(self, sampling_rate):
+        return max(1, int(round(self.block*sampling_rate)))
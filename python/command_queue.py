@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Maximum number of characters sent to the board in a single command string
+max_batch_length = 32
+
+
+class CommandQueue(threading.Thread):
+    """
+    Sends commands to the board on a single thread, in the order they were
+    submitted. A pending command is replaced by a newer one with the same key
+    (e.g. turning the same channel off and on again), and the pending commands
+    are joined into as few command strings as possible.
+    """
+    def __init__(self, send_fn, batch_length=max_batch_length):
+        super().__init__(daemon=True)
+        self.send_fn = send_fn
+        self.batch_length = batch_length
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = True
+        self.coalesced = 0
+
+    def submit(self, command, key=None):
+        """ Queues a command, the returned future is resolved with the response of the board """
+        future = Future()
+        with self.condition:
+            if not self.running:
+                future.set_exception(RuntimeError("The command queue is closed"))
+                return future
+            if key is None:
+                key = object()
+            if key in self.pending:
+                # Only the newest command is sent, every caller gets its result
+                _, futures = self.pending[key]
+                futures.append(future)
+                self.pending[key] = (command, futures)
+                self.coalesced += 1
+            else:
+                self.pending[key] = (command, [future])
+            self.condition.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                commands, futures = self.take_batch()
+            self.send(commands, futures)
+
+    def take_batch(self):
+        commands = []
+        futures = []
+        length = 0
+        while len(self.pending) > 0:
+            key, (command, command_futures) = next(iter(self.pending.items()))
+            if len(commands) > 0 and length+len(command) > self.batch_length:
+                break
+            del self.pending[key]
+            commands.append(command)
+            futures.extend(command_futures)
+            length += len(command)
+        return commands, futures
+
+    def send(self, commands, futures):
+        try:
+            response = self.send_fn("".join(commands))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future in futures:
+            future.set_result(response)
+
+    def close(self):
+        # Pending commands are sent before the thread ends
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
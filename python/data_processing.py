@@ -1,28 +1,71 @@
 import math
-import time
+import threading
+from collections import deque
 
-from brainflow.data_filter import DataFilter, FilterTypes, NoiseTypes, WindowOperations
-
-from graph import Function
+from function import Function
 from board import *
+from ring_buffer import RingBuffer
+from streaming_filter import StreamingFilter
+from spectrum import SpectralEstimator, default_hop, default_averages
+from qrs_detector import QRSDetector
+from band_power import BandPower, default_bands
+from clock import WallClock, ScaledClock
+from profiler import monitor
+
+# Outputs that can be requested to the processing pipeline
+wave_output = "wave"
+fft_output = "fft"
+impedance_output = "impedance"
+spectrogram_output = "spectrogram"
+ecg_output = "ecg"
+band_power_output = "band_power"
+all_outputs = {wave_output, fft_output, impedance_output, spectrogram_output, ecg_output, band_power_output}
 
-extra_window = 2
-overlap_percentage = 0.75
+# Outputs derived from the spectrum of each hop
+spectrum_outputs = {fft_output, spectrogram_output, band_power_output}
+
+# Spectrum columns and band powers kept until they are read
+spectrogram_columns = 256
+band_power_history = 256
 
 
 class DataProcessing:
-    def __init__(self, data_source, save_logs=True, gain=default_gain):
+    def __init__(self, data_source, save_logs=True, gain=default_gain, dtype=np.float64):
         self.data_source = data_source
         self.save_logs = save_logs
         self.gain = gain
-        self.speed = 1
+        # Precision of the window and spectrum
+        self.dtype = dtype
+        # Single precision keeps only the variations from the first samples, the offset is added back for display
+        self.remove_offset = np.dtype(dtype).itemsize < 8
+        self.offset = None
+        # Pace of the processing, live sessions follow the real time
+        self.clock = WallClock() if isinstance(data_source, Board) else ScaledClock()
         self.window_size = 4
+        self.psd_hop = default_hop
+        self.psd_averages = default_averages
+        self.bands = default_bands
+        # Rows of the board data processed, channel N is the N-th of them
+        self.exg_channels = data_source.get_exg_channels()
+        self.ecg_channels = get_ecg_channels(len(self.exg_channels))
+        self.channel_mask = np.ones(len(self.exg_channels), dtype=bool)
+        self.outputs = set(all_outputs)
         self.sampling_rate = None
         self.num_points = None
-        self.total_points = None
-        self.total_data = None
-        self.unprocessed_time = None
-        self.prev_time = None
+        self.time_axis = None
+        self.filter = None
+        self.buffer = None
+        self.spectrum = None
+        self.fft = None
+        # Spectrum of every hop, read by the spectrogram
+        self.spectrogram = deque(maxlen=spectrogram_columns)
+        self.band_power = None
+        # Band powers of every hop, (timestamp, powers of shape (channels, bands))
+        self.band_powers = deque(maxlen=band_power_history)
+        self.qrs = None
+        self.timestamp_channel = None
+        self.timestamp = None
+        self.lock = threading.Lock()
 
     def start(self):
         if not self.data_source.is_streaming():
@@ -30,100 +73,223 @@ class DataProcessing:
                 self.data_source.start(self.save_logs)
             else:
                 self.data_source.start()
+        if self.buffer is None:
             self.sampling_rate = BoardShim.get_sampling_rate(self.data_source.board_id)
+            self.timestamp_channel = BoardShim.get_timestamp_channel(self.data_source.board_id)
             self.num_points = self.sampling_rate*self.window_size
-            self.total_points = self.num_points+extra_window*self.sampling_rate
-            self.total_data = None
-        self.prev_time = None
+            self.time_axis = np.linspace(-self.window_size, 0, self.num_points)
+            # The recursive filter state stays in double precision, rounding errors would accumulate
+            self.filter = StreamingFilter(len(self.exg_channels), self.sampling_rate)
+            self.buffer = RingBuffer(len(self.exg_channels), self.num_points, self.dtype)
+            self.spectrum = SpectralEstimator(self.sampling_rate, self.num_points, self.psd_hop, self.psd_averages,
+                                              dtype=self.dtype)
+            self.band_power = BandPower(self.spectrum.freq, self.bands)
+            self.fft = None
+            self.offset = None
+            self.spectrogram.clear()
+            self.band_powers.clear()
+            if len(self.ecg_channels) > 0:
+                self.qrs = QRSDetector(len(self.ecg_channels), self.sampling_rate)
+        self.clock.reset()
 
     def stop(self):
         self.data_source.stop()
-        self.total_data = None
+        self.filter = None
+        self.buffer = None
+        self.spectrum = None
+        self.fft = None
+        self.spectrogram.clear()
+        self.band_power = None
+        self.band_powers.clear()
+        self.qrs = None
+        self.timestamp = None
 
     def forward(self):
         if self.data_source is None:
             return None, None, None
 
+        with self.lock, monitor.measure("forward"):
+            return self.process()
+
+    def process(self):
         samples = self.get_unprocessed_samples()
         if samples == 0:
             return None, None, None
+        return self.process_samples(samples)
 
-        new_data = np.multiply(self.data_source.read_data(samples), scale_factor)
+    def process_samples(self, samples):
+        """ Reads and processes the next `samples` samples of the data source, without pacing """
+        with monitor.measure("read"):
+            new_data = self.data_source.read_data(samples)
         if len(new_data) == 0:
             return None, None, None
+        self.update_timestamp(new_data)
+        with monitor.measure("filter"):
+            new_samples = self.append(new_data)
+        return self.get_functions(new_samples)
+
+    def get_functions(self, new_samples):
+        # Process data of the active channels and return the requested functions,
+        # inactive channels get empty functions
+        impedance = None
+        wave = None
+        fft = None
+        active = np.flatnonzero(self.channel_mask)
+        data = self.buffer.latest(self.num_points)[active]
+
+        if impedance_output in self.outputs:
+            with monitor.measure("impedance"):
+                impedance = [None]*len(self.exg_channels)
+                values = calculate_impedances(data[:, -self.sampling_rate:])
+                for row, i in enumerate(active):
+                    impedance[i] = float(values[row])
+
+        if wave_output in self.outputs:
+            wave = [Function() for _ in self.exg_channels]
+            for row, i in enumerate(active):
+                wave[i] = Function(self.time_axis, data[row] if self.offset is None else data[row]+self.offset[i])
 
-        if self.total_data is None:
-            self.total_data = list(np.zeros(shape=(self.total_points, len(new_data[0]))))
-        self.total_data.extend(new_data)
-        self.clip_data()
-
-        # Process data and return obtained functions
-        impedance = []
-        wave = []
-        fft = []
-        data = np.transpose(self.total_data)
-        offset = self.sampling_rate*extra_window
-        for i, channel in enumerate(exg_channels):
-            channel_data = np.array(data[channel])
-            self.filter_channel(channel_data)
-            channel_data = channel_data[offset-1:-1]
-            impedance.append(calculate_impedance(channel_data[-self.sampling_rate-1:-1]))
-            wave.append(Function(np.linspace(-self.window_size, 0, self.num_points), channel_data))
-            amp, freq = self.psd(channel_data)
-            fft.append(Function(freq, amp))
+        # Power Spectrum Density, between two hops the previous functions are returned
+        if len(self.outputs & spectrum_outputs) > 0:
+            with monitor.measure("psd"):
+                if self.spectrum.update(new_samples, data):
+                    if fft_output in self.outputs:
+                        self.fft = [Function() for _ in self.exg_channels]
+                        for row, i in enumerate(active):
+                            self.fft[i] = Function(self.spectrum.freq, self.spectrum.power[row])
+                    if spectrogram_output in self.outputs:
+                        # One column per hop, the inactive channels have no power
+                        column = np.zeros((len(self.exg_channels), len(self.spectrum.freq)), dtype=self.dtype)
+                        column[active] = self.spectrum.power
+                        self.spectrogram.append(column)
+                    if band_power_output in self.outputs:
+                        self.update_band_powers(active)
+            if fft_output in self.outputs:
+                fft = self.fft
         return impedance, wave, fft
 
-    def filter_channel(self, channel_data):
+    def get_spectrogram_columns(self):
+        """ Spectrum columns of the hops since the last call, oldest first """
+        columns = []
+        while len(self.spectrogram) > 0:
+            columns.append(self.spectrogram.popleft())
+        return columns
+
+    def update_band_powers(self, active):
+        # Bands of all the active channels from the same spectrum, inactive channels have no value
+        powers = np.full((len(self.exg_channels), len(self.band_power.names)), np.nan)
+        powers[active] = self.band_power.compute(self.spectrum.power)
+        self.band_powers.append((self.timestamp, powers))
+        if self.save_logs and isinstance(self.data_source, Board):
+            self.data_source.logger.write_band_powers(self.timestamp, self.band_power.names, powers)
+
+    def get_band_powers(self):
+        """ Band powers of the hops since the last call, oldest first, as (timestamp, powers) """
+        band_powers = []
+        while len(self.band_powers) > 0:
+            band_powers.append(self.band_powers.popleft())
+        return band_powers
+
+    def get_spectrogram_hop(self):
+        """ Seconds between two spectrum columns """
+        return self.spectrum.hop_samples/self.sampling_rate
+
+    def set_channel_active(self, channel, active):
+        # Channels are still filtered, so their window is valid as soon as they are enabled again
+        with self.lock:
+            self.channel_mask[channel-1] = active
+            if self.spectrum is not None:
+                self.spectrum.reset()
+
+    def set_outputs(self, outputs):
+        with self.lock:
+            # A newly requested output gets the spectrum of the current window right away
+            if len((set(outputs)-self.outputs) & spectrum_outputs) > 0 and self.spectrum is not None:
+                self.spectrum.reset()
+            self.outputs = set(outputs)
+
+    def update_timestamp(self, new_data):
+        # Board timestamp of the newest sample in the window
+        self.timestamp = float(new_data[-1, self.timestamp_channel])
+
+    def append(self, new_data):
+        # Only the new samples go through the filters, the window keeps filtered data
+        new_data = np.multiply(new_data[:, self.exg_channels].T, scale_factor)
+        if self.qrs is not None and ecg_output in self.outputs:
+            with monitor.measure("qrs"):
+                self.detect_beats(new_data[[ch-1 for ch in self.ecg_channels]])
+        if self.remove_offset:
+            if self.offset is None:
+                self.offset = new_data[:, 0].astype(self.dtype)
+            new_data = new_data-self.offset[:, np.newaxis]
+        filtered = self.filter.process(new_data).astype(self.dtype, copy=False)
+        self.buffer.write(filtered)
+        return filtered.shape[1]
+
+    def detect_beats(self, block):
+        for row, sample, rr in self.qrs.process(block):
+            # Timestamp of the R wave, counting back from the newest sample
+            timestamp = self.timestamp-(self.qrs.sample_count-1-sample)/self.sampling_rate
+            if self.save_logs and isinstance(self.data_source, Board):
+                self.data_source.logger.write_beat(timestamp, self.ecg_channels[row], rr)
+
+    def get_heart_rates(self):
+        """ Heart rate (bpm) and HRV (RMSSD in ms) of each ECG channel, None until there are enough beats """
+        qrs = self.qrs
+        if qrs is None:
+            return {}
+        return {ch: (qrs.get_heart_rate(row), qrs.get_hrv(row)) for row, ch in enumerate(self.ecg_channels)}
+
+    def seek(self, index):
         """
-        DataFilter.detrend(channel_data, DetrendOperations.CONSTANT.value)
-        DataFilter.perform_bandpass(channel_data, self.sampling_rate, 3.0, 45.0, 2, FilterTypes.BUTTERWORTH.value, 0)
-        DataFilter.perform_bandstop(channel_data, self.sampling_rate, 48.0, 52.0, 2, FilterTypes.BUTTERWORTH.value, 0)
-        DataFilter.perform_bandstop(channel_data, self.sampling_rate, 58.0, 62.0, 2, FilterTypes.BUTTERWORTH.value, 0)
+        Moves the playback to the given sample, the window is refilled with the
+        preceding samples. Returns the functions of the new window.
         """
-        DataFilter.perform_bandpass(channel_data, self.sampling_rate, 0, 45.0, 4, FilterTypes.BUTTERWORTH.value, 0)
-        # Environmental noise cancellation
-        DataFilter.remove_environmental_noise(channel_data, self.sampling_rate, NoiseTypes.FIFTY_AND_SIXTY.value)
-
-    # Calculates Power Spectrum Density
-    def psd(self, channel_data):
-        nfft = DataFilter.get_nearest_power_of_two(self.sampling_rate)
-        improvedData = channel_data[-nfft-1:-1]
-        improvedData = np.subtract(improvedData, np.average(improvedData))
-        return DataFilter.get_psd(improvedData, self.sampling_rate, WindowOperations.HAMMING.value)
-
-    def clip_data(self):
-        data_length = len(self.total_data)
-        if data_length > self.total_points:
-            slice_size = data_length-self.total_points
-            self.total_data = self.total_data[slice_size:]
+        if self.buffer is None:
+            return None, None, None
+
+        with self.lock:
+            start = max(0, index-self.num_points)
+            self.data_source.seek(start)
+            history = self.data_source.read_data(index-start)
+            self.filter.reset()
+            self.buffer.reset()
+            self.spectrum.reset()
+            self.fft = None
+            self.offset = None
+            self.spectrogram.clear()
+            self.band_powers.clear()
+            if self.qrs is not None:
+                self.qrs.reset()
+            self.timestamp = None
+            new_samples = 0
+            if len(history) > 0:
+                self.update_timestamp(history)
+                new_samples = self.append(history)
+            self.clock.reset()
+            return self.get_functions(new_samples)
+
+    def seek_time(self, timestamp):
+        return self.seek(self.data_source.find_time(timestamp))
 
     def get_unprocessed_samples(self):
-        if self.prev_time is None:
-            self.unprocessed_time = 0
-            self.prev_time = get_time()
-            return 0
-
-        curr_time = get_time()
-        passed_time = curr_time-self.prev_time
-        self.unprocessed_time += passed_time
-        self.prev_time = curr_time
-        time_per_sample = 1000/(self.sampling_rate*self.speed)
-        samples = int(self.unprocessed_time/time_per_sample)
-        self.unprocessed_time -= samples*time_per_sample
-        return samples
+        return self.clock.get_samples(self.sampling_rate)
+
+    def set_clock(self, clock):
+        with self.lock:
+            self.clock = clock
 
     def close(self):
         self.data_source.close()
 
 
 def calculate_impedance(channel_data):
-    stddev = DataFilter.calc_stddev(channel_data)
-    impedance = (math.sqrt(2)*stddev*1.0e-6)/drive_amps
-    impedance -= base_impedance_ohms
-    if impedance < 0:
-        impedance = 0
-    return impedance
+    return float(calculate_impedances(np.asarray(channel_data)[np.newaxis])[0])
 
 
-def get_time():
-    return time.time()*1000
\ No newline at end of file
+def calculate_impedances(data):
+    """ Impedance in ohms of every channel of a channel-major block """
+    stddev = np.std(data, axis=1)
+    impedance = (math.sqrt(2)*stddev*1.0e-6)/drive_amps
+    impedance -= base_impedance_ohms
+    return np.maximum(impedance, 0)
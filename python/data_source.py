@@ -1,3 +1,6 @@
+from brainflow.board_shim import BoardShim, BrainFlowError
+
+
 class DataSource:
     def __init__(self):
         self.streaming = False
@@ -11,6 +14,17 @@ class DataSource:
     def read_data(self, samples=1):
         pass
 
+    def get_exg_channels(self):
+        # Rows of the EXG channels in the board data
+        try:
+            return BoardShim.get_exg_channels(self.board_id)
+        except BrainFlowError:
+            return []
+
+    def get_backlog(self):
+        # Samples available but not read yet
+        return 0
+
     def is_streaming(self):
         return self.streaming
 
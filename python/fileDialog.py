@@ -1,6 +1,9 @@
-from PyQt5.QtWidgets import QFileDialog
+from PyQt5.QtWidgets import QFileDialog, QDialog
 from PyQt5.QtCore import QFileInfo
 
+from log_manager import has_catalog
+from session_browser import SessionBrowser, browse_result
+
 
 class FileBrowser(QFileDialog):
     def __init__(self):
@@ -9,7 +12,20 @@ class FileBrowser(QFileDialog):
         self.path = None
         self.filename = None
 
-    def showFileBrowser(self): self.path, _ = self.getOpenFileName(self)
+    def showFileBrowser(self, root=None):
+        # The records of an output directory with a catalog are searched without scanning the folders
+        if root is not None and has_catalog(root):
+            browser = SessionBrowser(root)
+            result = browser.exec()
+            if result == QDialog.Accepted:
+                self.path = browser.get_path()
+                return
+            if result != browse_result:
+                self.path = ""
+                return
+            self.path, _ = self.getOpenFileName(self, directory=root)
+            return
+        self.path, _ = self.getOpenFileName(self)
 
     def getPath(self): return self.path
 
@@ -0,0 +1,78 @@
+import time
+
+# Redraw rates of the render loop, in frames per second
+max_frame_rate = 60
+min_frame_rate = 10
+
+# Fraction of the frame interval that drawing may take, below `headroom` the rendering is raised again
+frame_budget = 0.5
+headroom = 0.25
+
+# Seconds between two adjustments
+adjust_interval = 1.0
+
+
+class FrameGovernor:
+    """
+    Adapts the render loop to the drawing cost. When frames take longer than the
+    budget the single-channel graphs are skipped first, then the redraw rate is
+    lowered; both are restored when there is headroom again. Acquisition and
+    recording run on their own thread and are not affected.
+    """
+    def __init__(self, max_rate=max_frame_rate, min_rate=min_frame_rate):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.frame_rate = max_rate
+        self.skip_single_waves = False
+        self.cost = 0
+        self.frames = 0
+        self.last_adjust = time.monotonic()
+
+    def reset(self):
+        self.frame_rate = self.max_rate
+        self.skip_single_waves = False
+        self.cost = 0
+        self.frames = 0
+        self.last_adjust = time.monotonic()
+
+    def get_interval(self):
+        """ Timer interval in milliseconds """
+        return 1000//self.frame_rate
+
+    def is_reduced(self):
+        return self.skip_single_waves or self.frame_rate < self.max_rate
+
+    def record(self, cost):
+        """
+        Accounts for a frame that took `cost` seconds to update and paint,
+        returns True if the rendering settings changed
+        """
+        self.cost += cost
+        self.frames += 1
+        if time.monotonic()-self.last_adjust < adjust_interval:
+            return False
+
+        # Fraction of the time spent drawing at the current rate
+        load = self.cost/self.frames*self.frame_rate
+        self.cost = 0
+        self.frames = 0
+        self.last_adjust = time.monotonic()
+
+        if load > frame_budget:
+            if not self.skip_single_waves:
+                self.skip_single_waves = True
+                return True
+            frame_rate = max(self.min_rate, int(self.frame_rate*frame_budget/load))
+        elif load < headroom:
+            if self.frame_rate == self.max_rate:
+                if self.skip_single_waves:
+                    self.skip_single_waves = False
+                    return True
+                return False
+            frame_rate = min(self.max_rate, int(self.frame_rate*frame_budget/max(load, frame_budget/2)))
+        else:
+            return False
+
+        changed = frame_rate != self.frame_rate
+        self.frame_rate = frame_rate
+        return changed
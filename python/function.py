@@ -0,0 +1,8 @@
+class Function:
+    def __init__(self, x=None, y=None):
+        if x is None:
+            x = []
+        if y is None:
+            y = []
+        self.x = x
+        self.y = y
@@ -1,5 +1,19 @@
+import time
+
 import numpy as np
-from pyqtgraph import PlotWidget, mkPen
+from PyQt5.QtCore import QRectF, pyqtSignal
+from pyqtgraph import PlotWidget, ImageItem, colormap, mkPen
+
+from function import Function
+from profiler import monitor
+from ring_buffer import RingBuffer
+
+# Seconds shown by the spectrogram and range of its colors
+spectrogram_length = 30
+spectrogram_range = 60
+
+# Power shown for empty columns and channels without signal
+power_floor = np.finfo(np.float32).tiny
 
 
 def decibel_scale(x):
@@ -9,20 +23,63 @@ def linear_scale(x, scale=1):
     return np.multiply(x, scale)
 
 
-class Function:
-    def __init__(self, x=None, y=None):
-        if x is None:
-            x = []
-        if y is None:
-            y = []
-        self.x = x
-        self.y = y
+def decimate(x, y, width):
+    """
+    Reduces the channel-major samples `y` to about 2 points per pixel, keeping the
+    minimum and the maximum of each pixel bucket so that spikes are preserved
+    """
+    num_samples = y.shape[1]
+    if width <= 0 or num_samples <= 2*width:
+        return x, y
+
+    bucket_size = num_samples//width
+    start = num_samples-bucket_size*width
+    buckets = y[:, start:].reshape(len(y), width, bucket_size)
+    x_buckets = np.asarray(x)[start:].reshape(width, bucket_size)
+
+    decimated_x = np.empty(2*width, dtype=x_buckets.dtype)
+    decimated_x[0::2] = x_buckets[:, 0]
+    decimated_x[1::2] = x_buckets[:, -1]
+    decimated_y = np.empty((len(y), 2*width), dtype=y.dtype)
+    decimated_y[:, 0::2] = np.min(buckets, axis=2)
+    decimated_y[:, 1::2] = np.max(buckets, axis=2)
+    return decimated_x, decimated_y
+
+
+def decimate_functions(functions, width):
+    if len(functions) == 0:
+        return functions
+    x, y = decimate(functions[0].x, np.array([f.y for f in functions]), width)
+    return [Function(x, channel_y) for channel_y in y]
+
+
+class PaintTimer:
+    """ Time spent painting all the graphs, collected by the render loop after each frame """
+    def __init__(self):
+        self.elapsed = 0
+
+    def add(self, duration):
+        self.elapsed += duration
+
+    def pop(self):
+        elapsed = self.elapsed
+        self.elapsed = 0
+        return elapsed
+
+
+# Shared by all the graphs
+paint_timer = PaintTimer()
 
 
 class Graph(PlotWidget):
+    # Emitted when the widget has been painted, with the curves of the last refresh()
+    painted = pyqtSignal()
+
     def __init__(self, resizer=None):
         super().__init__()
         self.plots = []
+        self.hidden_plots = set()
+        self.decimation = True
         self.resizer = Resizer() if resizer is None else resizer
 
         self.showGrid(x=True, y=True)
@@ -42,10 +99,15 @@ class Graph(PlotWidget):
     def hidePlot(self, index=1):
         if index <= len(self.plots):
             self.removeItem(self.plots[index - 1])
+            self.hidden_plots.add(index)
 
     def showPlot(self, index=1):
         if index <= len(self.plots):
             self.addItem(self.plots[index - 1])
+            self.hidden_plots.discard(index)
+
+    def isPlotVisible(self, index=1):
+        return index not in self.hidden_plots
 
     def addPlot(self, color):
         pen = mkPen(color=color)
@@ -56,19 +118,110 @@ class Graph(PlotWidget):
     def reset(self):
         self.clear()
         self.plots.clear()
+        self.hidden_plots.clear()
 
     def clearGraph(self):
         self.refresh([])
         self.resizer.reset()
 
     def refresh(self, data, scale_fn=linear_scale, **kwargs):
-        for i, plot in enumerate(self.plots):
-            if i < len(data):
-                y = scale_fn(data[i].y, **kwargs)
-                self.resizer.update(self, y)
-                plot.setData(data[i].x, y)
-            else:
-                plot.setData([], [])
+        with monitor.measure("refresh"):
+            self.refreshPlots(data, scale_fn, **kwargs)
+
+    def refreshPlots(self, data, scale_fn=linear_scale, **kwargs):
+        for plot in self.plots[len(data):]:
+            plot.setData([], [])
+        if not self.isVisible():
+            return
+
+        # Only visible plots are updated, all together
+        indices = [i for i in range(min(len(data), len(self.plots)))
+                   if self.isPlotVisible(i + 1) and len(data[i].y) > 0]
+        if len(indices) == 0:
+            return
+        x = data[indices[0]].x
+        y = scale_fn(np.array([data[i].y for i in indices]), **kwargs)
+        if self.decimation:
+            x, y = decimate(x, y, self.width())
+
+        self.resizer.update(self, y)
+        for row, i in enumerate(indices):
+            self.plots[i].setData(x, y[row])
+
+    def paintEvent(self, event):
+        # The curves set by refresh() are drawn here, when Qt repaints the widget
+        start_time = time.perf_counter()
+        with monitor.measure("paint"):
+            super().paintEvent(event)
+        paint_timer.add(time.perf_counter()-start_time)
+        self.painted.emit()
+
+
+class Spectrogram(PlotWidget):
+    """
+    Scrolling time-frequency image. The spectrum columns of every channel are
+    written once into a ring buffer, the image is a view of the selected channel.
+    """
+    def __init__(self, length=spectrogram_length):
+        super().__init__()
+        self.length = length
+        self.channel = 0
+        self.num_bins = 0
+        self.buffer = None
+        self.image = ImageItem()
+        self.image.setColorMap(colormap.get("viridis"))
+        self.addItem(self.image)
+
+        self.setLabel("left", "Frequency", "Hz")
+        self.setLabel("bottom", "Time", "s")
+        self.setDefaultPadding(0)
+        self.setXRange(-length, 0)
+        self.setYRange(0, 60)
+
+    def reset(self):
+        self.buffer = None
+        self.image.clear()
+
+    def setChannel(self, channel):
+        self.channel = channel
+        self.refreshImage()
+
+    def addColumns(self, columns, freq, hop):
+        """ Appends spectrum columns of shape (channels, bins), oldest first """
+        if len(columns) == 0:
+            return
+        with monitor.measure("spectrogram"):
+            num_channels = len(columns[0])
+            if self.buffer is None or self.buffer.num_channels != num_channels*len(freq):
+                # Rows of the buffer are the frequency bins of all channels
+                self.num_bins = len(freq)
+                self.buffer = RingBuffer(num_channels*self.num_bins, max(1, int(round(self.length/hop))), np.float32)
+                self.buffer.reset(decibel_scale(power_floor))
+                self.image.setRect(QRectF(-self.length, freq[0], self.length, freq[-1]-freq[0]))
+
+            power = np.stack(columns).reshape(len(columns), -1).T
+            self.buffer.write(decibel_scale(np.maximum(power, power_floor)))
+            self.refreshImage()
+
+    def refreshImage(self):
+        if self.buffer is None or not self.isVisible():
+            return
+        rows = self.buffer.latest()[self.channel*self.num_bins:(self.channel+1)*self.num_bins]
+        top = np.max(rows)
+        # Image axes are (time, frequency)
+        self.image.setImage(rows.T, autoLevels=False, levels=(top-spectrogram_range, top))
+
+    def paintEvent(self, event):
+        start_time = time.perf_counter()
+        with monitor.measure("paint"):
+            super().paintEvent(event)
+        paint_timer.add(time.perf_counter()-start_time)
+
+    def lightTheme(self):
+        self.setBackground("white")
+
+    def darkTheme(self):
+        self.setBackground("black")
 
 
 class Resizer:
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+from brainflow import BoardIds
+from brainflow.board_shim import BrainFlowError
+
+from board import Board
+from data_processing import DataProcessing, fft_output, impedance_output, ecg_output, band_power_output
+from log_manager import csv_format, binary_format, binary_dtype, float32_dtype
+from profiler import monitor
+
+# Processing rate of the headless loop
+update_interval = 1/30
+
+
+class FeatureSummary:
+    """ Session-wide averages of the channels spectrum and impedance """
+    def __init__(self, num_channels):
+        self.num_channels = num_channels
+        self.freq = None
+        self.psd_sum = None
+        self.impedance_sum = None
+        self.psd_count = 0
+        self.impedance_count = 0
+        self.last_fft = None
+
+    def update(self, impedance, fft):
+        # The spectrum only counts once per hop
+        if fft is not None and fft is not self.last_fft:
+            power = np.array([f.y for f in fft])
+            self.freq = fft[0].x
+            self.psd_sum = power if self.psd_sum is None else self.psd_sum+power
+            self.psd_count += 1
+            self.last_fft = fft
+        if impedance is not None:
+            values = np.array(impedance, dtype="float64")
+            self.impedance_sum = values if self.impedance_sum is None else self.impedance_sum+values
+            self.impedance_count += 1
+
+    def to_dict(self):
+        summary = {"channels": list(range(1, self.num_channels+1))}
+        if self.psd_count > 0:
+            summary["freq"] = np.asarray(self.freq).tolist()
+            summary["mean_psd"] = (self.psd_sum/self.psd_count).tolist()
+        if self.impedance_count > 0:
+            summary["mean_impedance"] = (self.impedance_sum/self.impedance_count).tolist()
+        return summary
+
+
+def parse_board(value):
+    if value.lstrip("-").isdigit():
+        return BoardIds(int(value))
+    return BoardIds[value.upper()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Records a session without the GUI.")
+    parser.add_argument("--board", type=parse_board, default=BoardIds.CYTON_DAISY_BOARD,
+                        help="BrainFlow board name or id (default: CYTON_DAISY_BOARD)")
+    parser.add_argument("--port", default="", help="serial port of the dongle")
+    parser.add_argument("--output", default=os.path.expanduser("~"), help="output directory of the recordings")
+    parser.add_argument("--format", choices=[csv_format, binary_format], default=csv_format,
+                        help="recording format (default: csv)")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="recording duration in seconds, until interrupted if omitted")
+    parser.add_argument("--float32", action="store_true",
+                        help="process (and record in binary format) in single precision")
+    parser.add_argument("--ecg", action="store_true",
+                        help="detect the heartbeats on the ECG channels (9-11) and save them in <record>_beats.csv")
+    parser.add_argument("--band-power", action="store_true",
+                        help="save the power of the EEG bands of every channel in <record>_band_power.csv")
+    parser.add_argument("--features", action="store_true",
+                        help="save average spectrum and impedance of the session in features.json")
+    parser.add_argument("--profile", default=None, help="JSON file where the stage timings are saved")
+    parser.add_argument("--name", default="", help="subject name")
+    parser.add_argument("--surname", default="", help="subject surname")
+    parser.add_argument("--description", default="", help="session description")
+    return parser.parse_args()
+
+
+def run(args):
+    try:
+        board = Board(args.board, args.port, args.output, args.format, float32_dtype if args.float32 else binary_dtype)
+    except BrainFlowError:
+        print("Board connection failed!")
+        return 1
+
+    if args.name != "" or args.surname != "" or args.description != "":
+        board.logger.save_metadata([args.name, args.surname, args.description])
+
+    # Stop on duration, Ctrl+C or termination signal
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    data_processing = DataProcessing(board, dtype=np.float32 if args.float32 else np.float64)
+    summary = FeatureSummary(len(data_processing.exg_channels)) if args.features else None
+    outputs = {fft_output, impedance_output} if args.features else set()
+    if args.ecg:
+        outputs.add(ecg_output)
+    if args.band_power:
+        outputs.add(band_power_output)
+    data_processing.set_outputs(outputs)
+    data_processing.start()
+    print(f"Recording in {board.logger.output_folder}")
+
+    start_time = time.monotonic()
+    while not stop_event.wait(update_interval):
+        impedance, _, fft = data_processing.forward()
+        if summary is not None:
+            summary.update(impedance, fft)
+        if args.duration is not None and time.monotonic()-start_time >= args.duration:
+            break
+
+    data_processing.stop()
+    data_processing.close()
+    if summary is not None:
+        with open(os.path.join(board.logger.output_folder, "features.json"), 'w') as file:
+            json.dump(summary.to_dict(), file)
+    if args.profile is not None:
+        monitor.dump(args.profile)
+    print(f"Recorded {time.monotonic()-start_time:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(run(parse_args()))
@@ -0,0 +1,122 @@
+import time
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+
+from board import scale_factor
+from data_processing import calculate_impedances
+from ring_buffer import RingBuffer
+from streaming_filter import StreamingFilter
+
+# Seconds of signal used to estimate the impedance
+impedance_window = 1.0
+
+# Seconds waited after the test current of a channel is turned on, before measuring
+settle_time = 1.0
+
+
+class ImpedanceEngine:
+    """
+    Impedance of the channels under test only. Their samples are filtered and
+    kept for `impedance_window` seconds, then the standard deviation of all of
+    them is computed at once.
+    """
+    def __init__(self, board, window=impedance_window):
+        self.board = board
+        self.sampling_rate = BoardShim.get_sampling_rate(board.board_id)
+        self.num_points = int(self.sampling_rate*window)
+        self.exg_channels = board.get_exg_channels()
+        self.channels = []
+        self.rows = []
+        self.filter = None
+        self.buffer = None
+
+    def start(self):
+        if not self.board.is_streaming():
+            self.board.start(False)
+
+    def stop(self):
+        self.board.stop()
+
+    def set_channels(self, channels):
+        self.channels = list(channels)
+        self.rows = [self.exg_channels[ch-1] for ch in self.channels]
+        self.filter = StreamingFilter(len(self.channels), self.sampling_rate)
+        self.buffer = RingBuffer(len(self.channels), self.num_points)
+
+    def reset(self):
+        # Samples of a previous state of the test current are discarded
+        if self.buffer is not None:
+            self.filter.reset()
+            self.buffer.reset()
+
+    def update(self):
+        """
+        Reads the new samples. Returns the impedances of the channels under test
+        once a whole window has been collected, otherwise None.
+        """
+        if len(self.channels) == 0 or not self.board.is_streaming():
+            return None
+        samples = self.board.get_backlog()
+        if samples == 0:
+            return None
+        new_data = self.board.read_data(samples)
+        if len(new_data) == 0:
+            return None
+
+        block = np.multiply(new_data[:, self.rows], scale_factor).T
+        self.buffer.write(self.filter.process(block))
+        if self.buffer.written < self.num_points:
+            return None
+        return calculate_impedances(self.buffer.latest(self.num_points))
+
+
+class ImpedanceSweep:
+    """
+    Tests the channels one after the other: the test current of each channel is
+    turned on, and after `settle_time` seconds a whole window is measured.
+    """
+    def __init__(self, board, engine, channels=None):
+        self.board = board
+        self.engine = engine
+        if channels is None:
+            channels = range(1, len(engine.exg_channels)+1)
+        self.pending = list(channels)
+        self.results = {}
+        self.channel = None
+        self.settled = False
+        self.start_time = None
+
+    def update(self):
+        """ Advances the sweep, returns True when every channel has been measured """
+        if self.channel is None:
+            if len(self.pending) == 0:
+                return True
+            self.channel = self.pending.pop(0)
+            self.board.toggle_impedance_checking(self.channel, True)
+            self.engine.set_channels([self.channel])
+            self.settled = False
+            self.start_time = time.monotonic()
+            return False
+
+        impedance = self.engine.update()
+        if not self.settled:
+            if time.monotonic()-self.start_time >= settle_time:
+                self.engine.reset()
+                self.settled = True
+            return False
+
+        if impedance is not None:
+            self.results[self.channel] = float(impedance[0])
+            self.board.toggle_impedance_checking(self.channel, False)
+            self.channel = None
+        return False
+
+    def cancel(self):
+        if self.channel is not None:
+            self.board.toggle_impedance_checking(self.channel, False)
+            self.channel = None
+        self.pending = []
+
+    def get_progress(self):
+        return len(self.results), len(self.results)+len(self.pending)+(self.channel is not None)
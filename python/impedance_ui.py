@@ -4,7 +4,7 @@ from PyQt5 import uic, QtCore, QtGui
 from PyQt5.QtWidgets import QWidget, QPushButton
 
 from board import exg_channels
-from data_processing import DataProcessing
+from impedance import ImpedanceEngine, ImpedanceSweep
 
 separator = os.path.sep
 
@@ -18,20 +18,31 @@ class ImpedanceUI(QWidget):
         super().__init__(*args, **kwargs)
         uic.loadUi(f"..{separator}GUI{separator}impedanceGUI.ui", self)
 
-        self.data_processing = DataProcessing(board, False, 1)
+        self.engine = ImpedanceEngine(board)
         self.board = board
         self.checking_button = None
         self.checking_channel = None
+        self.sweep = None
 
+        # Buttons of the channels the board does not have are disabled
+        num_channels = len(self.engine.exg_channels)
         for ch in exg_channels:
-            self.findChild(QPushButton, f"ch{ch}").clicked.connect(self.check_impedance)
+            self.get_button(ch).clicked.connect(self.check_impedance)
+            if ch > num_channels:
+                self.get_button(ch).setEnabled(False)
+                self.get_button(ch).setText("-")
+        self.sweepButton.clicked.connect(self.toggle_sweep)
 
         self.timer = QtCore.QTimer()
         self.timer.setInterval(150)
         self.timer.timeout.connect(self.update_impedance_value)
         self.timer.start()
 
+    def get_button(self, channel):
+        return self.findChild(QPushButton, f"ch{channel}")
+
     def check_impedance(self):
+        self.stop_sweep()
         self.stop_impedance_checking()
         self.checking_button = self.sender()
         new_checking_channel = int(self.checking_button.objectName()[2:])
@@ -41,25 +52,61 @@ class ImpedanceUI(QWidget):
             self.checking_channel = None
 
     def stop_impedance_checking(self):
-        self.data_processing.stop()
+        self.engine.stop()
         if self.checking_channel is not None:
             self.board.toggle_impedance_checking(self.checking_channel, False)
-            self.update_button("Test", "white")
+            self.update_button(self.checking_button, "Test", "white")
 
     def start_impedance_checking(self, channel):
         self.board.toggle_impedance_checking(channel, True)
         self.checking_channel = channel
-        self.data_processing.start()
+        self.engine.set_channels([channel])
+        self.engine.start()
+
+    # Methods for the sweep of all channels
+    def toggle_sweep(self):
+        if self.sweep is not None:
+            self.stop_sweep()
+            return
+
+        self.stop_impedance_checking()
+        self.checking_channel = None
+        for ch in range(1, len(self.engine.exg_channels)+1):
+            self.update_button(self.get_button(ch), "...", "white")
+        self.sweep = ImpedanceSweep(self.board, self.engine)
+        self.engine.start()
+        self.sweepButton.setText("Stop sweep")
+
+    def stop_sweep(self):
+        if self.sweep is None:
+            return
+        self.sweep.cancel()
+        self.sweep = None
+        self.engine.stop()
+        self.sweepButton.setText("Sweep all channels")
+
+    def update_sweep(self):
+        finished = self.sweep.update()
+        for channel, impedance in self.sweep.results.items():
+            self.show_impedance(self.get_button(channel), impedance)
+        if self.sweep.channel is not None and self.sweep.channel not in self.sweep.results:
+            self.update_button(self.get_button(self.sweep.channel), "Testing", "white")
+        if finished:
+            self.stop_sweep()
 
     def update_impedance_value(self):
+        if self.sweep is not None:
+            self.update_sweep()
+            return
         if self.checking_channel is None:
             return
 
-        impedance, _, _ = self.data_processing.forward()
+        impedance = self.engine.update()
         if impedance is None:
             return
+        self.show_impedance(self.checking_button, impedance[0])
 
-        imp = impedance[self.checking_channel-1]
+    def show_impedance(self, button, imp):
         kohms = int(imp/1000)
         if kohms < threshold_railed_warn:
             color = "lime"
@@ -67,13 +114,14 @@ class ImpedanceUI(QWidget):
             color = "yellow"
         else:
             color = "red"
-        self.update_button(str(kohms), color)
+        self.update_button(button, str(kohms), color)
 
-    def update_button(self, text, color):
-        self.checking_button.setStyleSheet(f"color: {color};")
-        self.checking_button.setText(text)
+    def update_button(self, button, text, color):
+        button.setStyleSheet(f"color: {color};")
+        button.setText(text)
 
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
+        self.stop_sweep()
         self.stop_impedance_checking()
         self.timer.stop()
         event.accept()
@@ -1,112 +1,691 @@
 import csv
+import json
 import os
+import queue
+import sqlite3
+import threading
+import time
 import numpy as np
+from contextlib import closing
 from datetime import datetime
 
-from brainflow.board_shim import BoardShim
+from brainflow.board_shim import BoardShim, BrainFlowError
+
+from profiler import monitor
+
+# Supported recording formats
+csv_format = "csv"
+binary_format = "bin"
+binary_dtype = "<f8"
+float32_dtype = "<f4"
+
+# Thresholds of the background record writer
+flush_size = 256*1024
+flush_interval = 1.0
+write_queue_size = 1024
+
+# Session folders are named after their creation time
+folder_format = "%m-%d-%Y_%H-%M-%S"
+
+# Index of the records of an output directory, saved in it
+catalog_file_name = "catalog.sqlite"
 
 
 class DataLogger:
-    def __init__(self, output_path, create_folder=True):
+    def __init__(self, output_path, create_folder=True, record_format=csv_format, record_dtype=binary_dtype):
         self.output_path = output_path
         self.output_folder = None
+        self.record_format = record_format
+        self.record_dtype = record_dtype
+        self.timestamp_channel = None
+        self.time_offset = 0.0
         self.record_num = 0
         self.output_file = None
         self.writer = None
+        self.record_writer = None
+        self.latency_file = None
+        self.latency_writer = None
+        self.latency_record_writer = None
+        self.beats_file = None
+        self.beats_writer = None
+        self.beats_record_writer = None
+        self.band_power_file = None
+        self.band_power_writer = None
+        self.band_power_record_writer = None
+        self.metadata = None
+        self.catalog = None
+        self.record_path = None
+        self.sampling_rate = None
+        self.samples_written = 0
 
         if create_folder:
-            self.output_folder = os.path.join(self.output_path, datetime.now().strftime("%m-%d-%Y_%H-%M-%S"))
+            self.output_folder = os.path.join(self.output_path, datetime.now().strftime(folder_format))
             os.makedirs(self.output_folder, exist_ok=True)
+            self.catalog = SessionCatalog(self.output_path)
 
     def save_metadata(self, metadata):
-        file = open(self.output_folder + "metadata.csv", 'w')
+        self.metadata = metadata
+        file = open(os.path.join(self.output_folder, "metadata.csv"), 'w')
         writer = csv.writer(file)
         writer.writerow(["Name", "Surname", "Description"])
         writer.writerow(metadata)
         file.close()
+        if self.catalog is not None:
+            self.catalog.set_metadata(self.output_folder, metadata)
 
     def create_new_record(self, board, exg_channels):
-        # Create writer
-        files = os.listdir(self.output_folder)
-        self.record_num = len(files)
-        if "metadata.csv" not in files:
-            self.record_num += 1
-
-        output_file_name = os.path.join(self.output_folder, str(self.record_num) + ".csv")
-        self.output_file = open(output_file_name, 'w')
-        self.writer = csv.writer(self.output_file)
-        self.record_num += 1
-
-        accel_channels = BoardShim.get_accel_channels(board.board_id)
-        analog_channels = BoardShim.get_analog_channels(board.board_id)
-
-        # Write board information
-        self.writer.writerow([int(board.board_id)])
-
-        # Write column headers
-        headers = ["Packet Num"]
-        headers.extend([f"EXG Channel {ch}" for ch in exg_channels])
-        headers.extend([f"Accel Channel {ch}" for ch in accel_channels])
-        headers.extend(["Other"]*7)
-        headers.extend([f"Analog Channel {ch}" for ch in analog_channels])
-        headers.extend(["Timestamp", "Other"])
-        self.writer.writerow(headers)
+        self.record_num = self.next_record_num()
+        headers = get_headers(board.board_id, exg_channels)
+        output_file_name = os.path.join(self.output_folder, f"{self.record_num}.{self.record_format}")
+
+        if self.record_format == binary_format:
+            # Single precision cannot hold epoch timestamps, they are saved relative to the record start
+            self.timestamp_channel = BoardShim.get_timestamp_channel(board.board_id)
+            self.time_offset = 0.0 if np.dtype(self.record_dtype).itemsize == 8 else float(int(time.time()))
+
+            # Raw samples in a single file, board information in a JSON sidecar
+            info = {
+                "board_id": int(board.board_id),
+                "dtype": self.record_dtype,
+                "time_offset": self.time_offset,
+                "num_columns": BoardShim.get_num_rows(board.board_id),
+                "headers": headers,
+                "exg_channels": list(exg_channels),
+                "metadata": self.metadata
+            }
+            with open(get_sidecar_path(output_file_name), 'w') as file:
+                json.dump(info, file, indent=2)
+            self.output_file = open(output_file_name, 'wb')
+        else:
+            # Create writer
+            self.output_file = open(output_file_name, 'w')
+            self.writer = csv.writer(self.output_file)
+
+            # Write board information and column headers
+            self.writer.writerow([int(board.board_id)])
+            self.writer.writerow(headers)
+
+        self.record_path = output_file_name
+        self.sampling_rate = BoardShim.get_sampling_rate(board.board_id)
+        self.samples_written = 0
+        if self.catalog is not None:
+            self.catalog.add_record(output_file_name, board.board_id, exg_channels, self.metadata,
+                                    start_time=datetime.now())
+
+        self.record_writer = RecordWriter(self.write_chunks, self.output_file)
+        self.record_writer.start()
+
+    def next_record_num(self):
+        records = [int(name.split(".")[0]) for name in os.listdir(self.output_folder) if name.split(".")[0].isdigit()]
+        return max(records, default=0)+1
 
     def write_data(self, data):
-        if self.writer is not None:
-            for row in data:
-                if len(row) > 0:
-                    self.writer.writerow(row)
+        if self.record_writer is None or np.ndim(data) != 2 or np.size(data) == 0:
+            return
+        self.record_writer.put(data)
+
+    def write_chunks(self, chunks):
+        # Called by the record writer thread
+        if self.record_format == binary_format:
+            # All pending chunks in a single buffered write
+            data = np.concatenate(chunks)
+            if self.time_offset != 0:
+                data[:, self.timestamp_channel] -= self.time_offset
+            self.output_file.write(np.ascontiguousarray(data, dtype=self.record_dtype))
+        else:
+            for data in chunks:
+                self.writer.writerows(data)
+        self.samples_written += sum(len(data) for data in chunks)
+
+    def write_latency(self, timestamp, latency):
+        # Called by the GUI thread once per frame, the rows are written by a background writer
+        if self.record_writer is None:
+            return
+        if self.latency_record_writer is None:
+            # Acquisition to display latency of the frames shown during the record
+            self.latency_file = open(os.path.join(self.output_folder, f"{self.record_num}_latency.csv"), 'w')
+            self.latency_writer = csv.writer(self.latency_file)
+            self.latency_writer.writerow(["Timestamp", "Latency (ms)"])
+            self.latency_record_writer = RecordWriter(self.write_latency_chunks, self.latency_file)
+            self.latency_record_writer.start()
+        self.latency_record_writer.put(np.array([[timestamp, latency]]))
+
+    def write_latency_chunks(self, chunks):
+        # Called by the latency writer thread
+        for rows in chunks:
+            for timestamp, latency in rows:
+                self.latency_writer.writerow([timestamp, round(latency*1000, 3)])
+
+    def write_beat(self, timestamp, channel, rr):
+        # Called by the acquisition thread, the rows are written by a background writer like the samples
+        if self.record_writer is None:
+            return
+        if self.beats_record_writer is None:
+            # R waves detected on the ECG channels during the record
+            self.beats_file = open(os.path.join(self.output_folder, f"{self.record_num}_beats.csv"), 'w')
+            self.beats_writer = csv.writer(self.beats_file)
+            self.beats_writer.writerow(["Timestamp", "Channel", "RR (ms)"])
+            self.beats_record_writer = RecordWriter(self.write_beat_chunks, self.beats_file)
+            self.beats_record_writer.start()
+        self.beats_record_writer.put(np.array([[timestamp, channel, np.nan if rr is None else rr]]))
+
+    def write_beat_chunks(self, chunks):
+        # Called by the beats writer thread
+        for rows in chunks:
+            for timestamp, channel, rr in rows:
+                self.beats_writer.writerow([timestamp, int(channel), "" if np.isnan(rr) else round(rr*1000, 1)])
+
+    def write_band_powers(self, timestamp, bands, powers):
+        if self.record_writer is None:
+            return
+        if self.band_power_record_writer is None:
+            # One row per spectrum hop, the power of every band of every channel
+            self.band_power_file = open(os.path.join(self.output_folder, f"{self.record_num}_band_power.csv"), 'w')
+            self.band_power_writer = csv.writer(self.band_power_file)
+            self.band_power_writer.writerow(["Timestamp"]+[f"CH{ch} {band}" for ch in range(1, len(powers)+1)
+                                                           for band in bands])
+            self.band_power_record_writer = RecordWriter(self.write_band_power_chunks, self.band_power_file)
+            self.band_power_record_writer.start()
+        self.band_power_record_writer.put(np.concatenate(([timestamp], np.ravel(powers)))[np.newaxis])
+
+    def write_band_power_chunks(self, chunks):
+        # Called by the band power writer thread
+        for rows in chunks:
+            for row in rows:
+                self.band_power_writer.writerow([row[0]]+[f"{power:.6g}" for power in row[1:]])
+
+    def get_stats(self):
+        if self.record_writer is None:
+            return None
+        return {
+            "queue_depth": self.record_writer.get_queue_depth(),
+            "bytes_per_sec": self.record_writer.bytes_per_sec,
+            "bytes_written": self.record_writer.bytes_written
+        }
 
     def close(self):
+        if self.record_writer is not None:
+            # Write every queued sample before closing the file
+            self.record_writer.close()
+            self.record_writer = None
         if self.output_file is not None:
             self.output_file.close()
             self.output_file = None
             self.writer = None
+        if self.catalog is not None and self.record_path is not None:
+            self.catalog.update_length(self.record_path, self.samples_written,
+                                       self.samples_written/self.sampling_rate)
+            self.record_path = None
+        if self.latency_record_writer is not None:
+            self.latency_record_writer.close()
+            self.latency_record_writer = None
+        if self.latency_file is not None:
+            self.latency_file.close()
+            self.latency_file = None
+            self.latency_writer = None
+        if self.beats_record_writer is not None:
+            self.beats_record_writer.close()
+            self.beats_record_writer = None
+        if self.beats_file is not None:
+            self.beats_file.close()
+            self.beats_file = None
+            self.beats_writer = None
+        if self.band_power_record_writer is not None:
+            self.band_power_record_writer.close()
+            self.band_power_record_writer = None
+        if self.band_power_file is not None:
+            self.band_power_file.close()
+            self.band_power_file = None
+            self.band_power_writer = None
+
+
+class RecordWriter(threading.Thread):
+    """
+    Writes record chunks on a background thread. Queued chunks are grouped and
+    written together once flush_size bytes are pending or flush_interval seconds
+    have passed since the last flush.
+    """
+    def __init__(self, write_fn, output_file):
+        super().__init__(daemon=True)
+        self.write_fn = write_fn
+        self.output_file = output_file
+        self.queue = queue.Queue(write_queue_size)
+        self.bytes_written = 0
+        self.bytes_per_sec = 0
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def get_queue_depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        pending = []
+        pending_size = 0
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                timeout = max(0.0, flush_interval-(time.monotonic()-last_flush))
+                data = self.queue.get(timeout=timeout)
+                if data is None:
+                    running = False
+                else:
+                    pending.append(data)
+                    pending_size += data.nbytes
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if not running or pending_size >= flush_size or now-last_flush >= flush_interval:
+                self.flush(pending, now-last_flush)
+                pending = []
+                pending_size = 0
+                last_flush = now
+
+    def flush(self, pending, elapsed):
+        try:
+            with monitor.measure("record_write"):
+                if len(pending) > 0:
+                    self.write_fn(pending)
+                self.output_file.flush()
+            size = os.fstat(self.output_file.fileno()).st_size
+        except OSError:
+            print("Writing record data failed!")
+            return
+
+        if elapsed > 0:
+            self.bytes_per_sec = (size-self.bytes_written)/elapsed
+        self.bytes_written = size
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+def get_headers(board_id, exg_channels):
+    # A header for every row of the board data, the rows not used are "Other"
+    descr = BoardShim.get_board_descr(board_id)
+    headers = ["Other"]*descr["num_rows"]
+    headers[descr["package_num_channel"]] = "Packet Num"
+    for ch in exg_channels:
+        headers[ch] = f"EXG Channel {ch}"
+    for ch in descr.get("accel_channels", []):
+        headers[ch] = f"Accel Channel {ch}"
+    for ch in descr.get("analog_channels", []):
+        headers[ch] = f"Analog Channel {ch}"
+    headers[descr["timestamp_channel"]] = "Timestamp"
+    return headers
+
+
+def get_exg_columns(headers):
+    return [i for i, header in enumerate(headers) if header.startswith("EXG Channel")]
+
+
+def get_sidecar_path(file_path):
+    return os.path.splitext(file_path)[0]+".json"
+
+
+def is_binary_record(file_path):
+    return file_path.endswith("."+binary_format)
+
+
+def load_sidecar(file_path):
+    try:
+        with open(get_sidecar_path(file_path), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def load_metadata(folder):
+    """ [name, surname, description] saved in the session folder, None without metadata """
+    path = os.path.join(folder, "metadata.csv")
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return next(reader, None)
+
+
+def get_record_info(file_path):
+    """
+    Board id, EXG channels and number of samples of a record, read from the
+    sidecar or the first rows of the CSV without loading the data. The samples
+    of a CSV are estimated from the file size and the length of its first row.
+    """
+    if is_binary_record(file_path):
+        info = load_sidecar(file_path)
+        if info is None:
+            return None
+        board_id = info["board_id"]
+        exg_channels = info.get("exg_channels") or get_exg_columns(info["headers"])
+        row_size = info["num_columns"]*np.dtype(info["dtype"]).itemsize
+        samples = os.path.getsize(file_path)//row_size
+    else:
+        with open(file_path, 'rb') as file:
+            try:
+                board_id = int(float(next(csv.reader([file.readline().decode()]))[0]))
+                exg_channels = get_exg_columns(next(csv.reader([file.readline().decode()])))
+            except (StopIteration, IndexError, ValueError, UnicodeDecodeError):
+                return None
+            data_start = file.tell()
+            first_row = file.readline()
+        samples = 0 if len(first_row) == 0 else round((os.path.getsize(file_path)-data_start)/len(first_row))
+    if len(exg_channels) == 0:
+        exg_channels = BoardShim.get_exg_channels(board_id)
+    return board_id, exg_channels, samples
+
+
+class SessionCatalog:
+    """
+    SQLite index of the records of an output directory, one row per record with
+    its session folder, subject, board, channels and length. DataLogger adds the
+    records it creates, scan() indexes the folders written by older versions.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, catalog_file_name)
+        self.execute("""CREATE TABLE IF NOT EXISTS records (
+                            path TEXT PRIMARY KEY, folder TEXT, record_num INTEGER, board_id INTEGER,
+                            format TEXT, channels INTEGER, exg_channels TEXT, name TEXT, surname TEXT,
+                            description TEXT, start_time TEXT, samples INTEGER, duration REAL)""")
+        self.execute("CREATE INDEX IF NOT EXISTS subject_index ON records (surname, name)")
+        self.execute("CREATE INDEX IF NOT EXISTS time_index ON records (start_time)")
+
+    def execute(self, query, params=(), many=False):
+        # A connection per operation, records are created by a thread and searched by another
+        try:
+            with closing(sqlite3.connect(self.path, timeout=5)) as connection:
+                with connection:
+                    if many:
+                        connection.executemany(query, params)
+                        return []
+                    return connection.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"Session catalog {self.path}: {e}")
+            return []
+
+    def get_row(self, file_path, board_id, exg_channels, metadata, samples=0, start_time=None):
+        path = os.path.relpath(file_path, self.root)
+        folder = os.path.dirname(path)
+        record_num, extension = os.path.splitext(os.path.basename(path))
+        if start_time is None:
+            try:
+                start_time = datetime.strptime(os.path.basename(folder), folder_format)
+            except ValueError:
+                start_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+        name, surname, description = get_subject(metadata)
+        duration = samples/BoardShim.get_sampling_rate(board_id)
+        return (path, folder, int(record_num), int(board_id), extension[1:], len(exg_channels),
+                json.dumps([int(ch) for ch in exg_channels]), name, surname, description,
+                start_time.isoformat(sep=" ", timespec="seconds"), samples, duration)
+
+    def add_record(self, file_path, board_id, exg_channels, metadata=None, samples=0, start_time=None):
+        row = self.get_row(file_path, board_id, exg_channels, metadata, samples, start_time)
+        self.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def update_length(self, file_path, samples, duration):
+        self.execute("UPDATE records SET samples = ?, duration = ? WHERE path = ?",
+                     (samples, duration, os.path.relpath(file_path, self.root)))
+
+    def set_metadata(self, folder, metadata):
+        name, surname, description = get_subject(metadata)
+        self.execute("UPDATE records SET name = ?, surname = ?, description = ? WHERE folder = ?",
+                     (name, surname, description, os.path.relpath(folder, self.root)))
+
+    def scan(self):
+        """
+        Indexes the records of the session folders not in the catalog and removes
+        the folders deleted since the last scan. Returns the number of records indexed.
+        """
+        indexed = {row[0] for row in self.execute("SELECT DISTINCT folder FROM records")}
+        try:
+            folders = {entry.name for entry in os.scandir(self.root) if entry.is_dir()}
+        except OSError as e:
+            print(f"Session catalog {self.root}: {e}")
+            return 0
+
+        removed = [(folder,) for folder in indexed - folders]
+        if len(removed) > 0:
+            self.execute("DELETE FROM records WHERE folder = ?", removed, many=True)
+
+        # Records without samples were not closed (e.g. the program crashed), their length is read again
+        files = []
+        for row in self.execute("SELECT path FROM records WHERE samples = 0"):
+            if os.path.isfile(os.path.join(self.root, row[0])):
+                files.append(os.path.join(self.root, row[0]))
+            else:
+                self.execute("DELETE FROM records WHERE path = ?", row)
+        for folder in sorted(folders - indexed):
+            folder_path = os.path.join(self.root, folder)
+            for file_name in sorted(os.listdir(folder_path)):
+                record_num, extension = os.path.splitext(file_name)
+                if record_num.isdigit() and extension[1:] in (csv_format, binary_format):
+                    files.append(os.path.join(folder_path, file_name))
+
+        rows = []
+        metadata = {}
+        for file_path in files:
+            folder_path = os.path.dirname(file_path)
+            if folder_path not in metadata:
+                metadata[folder_path] = load_metadata(folder_path)
+            try:
+                info = get_record_info(file_path)
+                if info is not None:
+                    rows.append(self.get_row(file_path, *info[:2], metadata[folder_path], info[2]))
+            except (OSError, BrainFlowError, KeyError, ValueError) as e:
+                print(f"Session catalog: cannot index {file_path}: {e}")
+        if len(rows) > 0:
+            self.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows, many=True)
+        return len(rows)
+
+    def search(self, text="", limit=1000):
+        """
+        Records whose subject, description or path contain every word of `text`,
+        newest first, as dictionaries with the absolute path of the file
+        """
+        conditions = []
+        params = []
+        for word in text.split():
+            conditions.append("(name LIKE ? OR surname LIKE ? OR description LIKE ? OR path LIKE ?)")
+            params += [f"%{word}%"]*4
+        where = f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+        rows = self.execute(f"""SELECT path, board_id, exg_channels, name, surname, description, start_time,
+                                     samples, duration FROM records {where}
+                                     ORDER BY start_time DESC, record_num LIMIT ?""", params+[limit])
+        keys = ("path", "board_id", "exg_channels", "name", "surname", "description", "start_time", "samples",
+                "duration")
+        records = []
+        for row in rows:
+            record = dict(zip(keys, row))
+            record["path"] = os.path.join(self.root, record["path"])
+            record["exg_channels"] = json.loads(record["exg_channels"])
+            records.append(record)
+        return records
+
+
+def get_subject(metadata):
+    # Name, surname and description, empty without metadata
+    if not metadata:
+        return "", "", ""
+    return tuple((list(metadata)+[""]*3)[:3])
+
+
+def has_catalog(root):
+    return os.path.isfile(os.path.join(root, catalog_file_name))
+
+
+def update_catalog_length(file_path, board_id, samples):
+    """ Saves the exact length of a loaded record in the catalog of its output directory, if any """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(file_path)))
+    if has_catalog(root):
+        duration = samples/BoardShim.get_sampling_rate(board_id)
+        SessionCatalog(root).update_length(os.path.abspath(file_path), samples, duration)
+
+
+def export_csv(file_path, csv_path=None):
+    """ Converts a binary record into the CSV format """
+    info = load_sidecar(file_path)
+    if csv_path is None:
+        csv_path = os.path.splitext(file_path)[0]+".csv"
+    data = np.fromfile(file_path, dtype=info["dtype"]).reshape(-1, info["num_columns"]).astype(np.float64)
+    data[:, BoardShim.get_timestamp_channel(info["board_id"])] += info.get("time_offset", 0)
+    with open(csv_path, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow([info["board_id"]])
+        writer.writerow(info["headers"])
+        writer.writerows(data)
+    return csv_path
 
 
 class LogParser:
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache=True):
         self.file_path = file_path
-        self.board_id = self.begin()
+        # Without cache the CSV is parsed in memory and nothing is written next to the record
+        self.cache = cache
+        self.data = None
+        self.time_index = None
+        self.position = 0
+        self.has_new_data = False
+        self.board_id = -1
+        self.exg_channels = None
+        self.time_offset = 0
+        self.begin()
 
     def load_metadata(self):
-        folder = os.path.dirname(self.file_path)
-        files = os.listdir(folder)
-        if "metadata.csv" in files:
-            file = open(os.path.join(folder, "metadata.csv"), 'r')
-            reader = csv.reader(file)
-            next(reader)
-            info = next(reader)
-            file.close()
-            return info
-        return None
+        return load_metadata(os.path.dirname(self.file_path))
 
     def begin(self):
-        self.file = open(self.file_path, 'r')
-        self.reader = csv.reader(self.file)
-        info = next(self.reader)
-        next(self.reader)
+        if self.data is None:
+            self.board_id = self.load()
+        self.position = 0
+        self.has_new_data = self.data is not None and len(self.data) > 0
+        return self.board_id
+
+    def load(self):
+        if is_binary_record(self.file_path):
+            return self.load_binary()
+        return self.load_csv()
+
+    def load_binary(self):
+        info = load_sidecar(self.file_path)
+        if info is None:
+            return -1
+        self.exg_channels = info.get("exg_channels")
+        self.time_offset = info.get("time_offset", 0)
+
+        # Samples are mapped directly from the record file
+        dtype = np.dtype(info["dtype"])
+        num_columns = info["num_columns"]
+        num_rows = os.path.getsize(self.file_path)//(num_columns*dtype.itemsize)
+        if num_rows == 0:
+            self.data = np.empty((0, num_columns), dtype=dtype)
+        else:
+            self.data = np.memmap(self.file_path, dtype=dtype, mode='r', shape=(num_rows, num_columns))
+        return int(info["board_id"])
+
+    def load_csv(self):
+        with open(self.file_path, 'r') as file:
+            reader = csv.reader(file)
+            info = next(reader, [""])
+            headers = next(reader, [])
         try:
-            self.has_new_data = True
-            return int(info[0])
-        except ValueError:
-            self.has_new_data = False
+            board_id = int(info[0])
+        except (ValueError, IndexError):
             return -1
+        self.exg_channels = get_exg_columns(headers)
 
-    def read_data(self, num_rows=1):
-        data = []
-        for i in range(num_rows):
+        # The CSV is parsed once and cached as a binary array next to it
+        cache_path = get_cache_path(self.file_path)
+        if not is_cache_valid(self.file_path, cache_path):
+            try:
+                data = np.loadtxt(self.file_path, delimiter=",", skiprows=2, dtype="float64", ndmin=2)
+            except ValueError:
+                print("Samples array has an invalid size!")
+                return -1
+            if not self.cache:
+                self.data = data
+                return board_id
             try:
-                data.append(np.array(next(self.reader), dtype="float64"))
-            except StopIteration:
-                self.has_new_data = False
-                break
+                temp_path = cache_path+".tmp"
+                with open(temp_path, 'wb') as file:
+                    np.save(file, data)
+                os.replace(temp_path, cache_path)
+            except OSError:
+                self.data = data
+                return board_id
 
         try:
-            return np.array(data)
+            self.data = np.load(cache_path, mmap_mode='r')
         except ValueError:
-            print("Samples array has an invalid size!")
+            self.data = np.load(cache_path)
+        return board_id
+
+    def read_data(self, num_rows=1):
+        if self.data is None:
+            return np.array([])
+
+        # Rows are returned as a view, without copies
+        data = self.data[self.position:self.position+num_rows]
+        self.position += len(data)
+        if self.position >= len(self.data):
+            self.has_new_data = False
+        if self.time_offset != 0:
+            # Single precision records: rows are returned in double precision with absolute timestamps
+            data = np.array(data, dtype=np.float64)
+            data[:, BoardShim.get_timestamp_channel(self.board_id)] += self.time_offset
+        return data
+
+    def get_exg_channels(self):
+        # Records without headers have the channels of their board
+        if self.exg_channels:
+            return self.exg_channels
+        try:
+            return BoardShim.get_exg_channels(self.board_id)
+        except BrainFlowError:
+            return []
+
+    def get_length(self):
+        return 0 if self.data is None else len(self.data)
+
+    def seek(self, index):
+        self.position = min(max(0, index), self.get_length())
+        self.has_new_data = self.position < self.get_length()
+
+    def find_time(self, timestamp):
+        # Binary search over the cached timestamp index
+        return int(np.searchsorted(self.get_time_index(), timestamp))
+
+    def get_time_index(self):
+        if self.time_index is None:
+            index_path = get_index_path(self.file_path)
+            if is_cache_valid(self.file_path, index_path):
+                self.time_index = np.load(index_path)
+            else:
+                timestamps = self.data[:, BoardShim.get_timestamp_channel(self.board_id)].astype(np.float64)+self.time_offset
+                # Timestamps are made non-decreasing so that the index can be searched
+                self.time_index = np.maximum.accumulate(timestamps)
+                if self.cache:
+                    try:
+                        np.save(index_path, self.time_index)
+                    except OSError:
+                        pass
+        return self.time_index
 
     def close(self):
-        self.file.close()
\ No newline at end of file
+        self.data = None
+        self.time_index = None
+
+
+def get_cache_path(file_path):
+    return os.path.splitext(file_path)[0]+".cache.npy"
+
+
+def get_index_path(file_path):
+    return os.path.splitext(file_path)[0]+".index.npy"
+
+
+def is_cache_valid(file_path, cache_path):
+    return os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path)
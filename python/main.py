@@ -1,17 +1,25 @@
 import os
 import sys
+import time
 
 from PyQt5 import uic, QtCore, QtGui
 from PyQt5.QtWidgets import *
 import serial.tools.list_ports
+import numpy as np
 from brainflow import BoardIds
 
-from board import exg_channels, ecg_channels, Board
+from board import exg_channels, ecg_channels, get_ecg_channels, Board
+from log_manager import csv_format, binary_format, binary_dtype, float32_dtype, update_catalog_length
 from brainflow.board_shim import BrainFlowError
-from graph import Resizer, Graph, decibel_scale
-from data_processing import DataProcessing
+from graph import Resizer, Graph, decibel_scale, decimate_functions, paint_timer
+from data_processing import DataProcessing, wave_output, fft_output, spectrogram_output, ecg_output, band_power_output
+from acquisition import AcquisitionWorker, FrameQueue, Frame
+from frame_governor import FrameGovernor
+from clock import ScaledClock, UnthrottledClock
+from profiler import monitor
 from playback import PlaybackManager
 from impedance_ui import ImpedanceUI
+from spectrogram_ui import SpectrogramUI
 from alert_dialog import AlertDialog
 import aboutDialog
 import fileDialog
@@ -28,6 +36,10 @@ type_of_board = {  # Supported types of boards
     "GANGLION BOARD": BoardIds.GANGLION_BOARD,
     "GANGLION WIFI BOARD": BoardIds.GANGLION_WIFI_BOARD
 }
+record_formats = {  # Supported recording formats
+    "CSV": csv_format,
+    "Binary": binary_format
+}
 
 
 class MainWindow(QMainWindow):
@@ -46,13 +58,24 @@ class MainWindow(QMainWindow):
         # Additional windows loading
         self.aboutWindow = aboutDialog.AboutDialog()
         self.imp_ui = None
+        self.spectrogramWindow = SpectrogramUI()
+        self.spectrogramWindow.hidden.connect(self.updateOutputs)
         self.darkTheme = None
 
         self.data_processing = None
         self.timer = None
+        self.worker = None
+        self.frames = FrameQueue()
+        self.governor = FrameGovernor()
+        self.statusText = ""
+        self.statusTime = 0
         self.singleWaves = None
+        self.channels = exg_channels
+        self.lastFft = None
+        self.latencyFrame = None
 
         self.waveWidget = Graph()
+        self.waveWidget.painted.connect(self.recordLatency)
         self.waveWidget.setLabels("Time", "s", "Amplitude", "V")
         self.waveContainer.addWidget(self.waveWidget)
 
@@ -119,6 +142,7 @@ class MainWindow(QMainWindow):
             self.stopButton.setEnabled(True)
             self.calculateUpdateSpeed()
             self.data_processing.start()
+            self.initTimeline()
             self.startLoop()
         else:
             self.playButton.setIcon(self.playIcon)
@@ -127,6 +151,7 @@ class MainWindow(QMainWindow):
     def stop(self):
         self.stopLoop()
         self.data_processing.stop()
+        self.resetTimeline()
         self.clearGraphs()
         self.playButton.setEnabled(True)
         self.playButton.setIcon(self.playIcon)
@@ -136,38 +161,202 @@ class MainWindow(QMainWindow):
         self.waveWidget.clearGraph()
         self.fftWidget.clearGraph()
         self.ecgWidget.clearGraph()
+        self.spectrogramWindow.reset()
         if self.singleWaves is not None:
             for wave in self.singleWaves:
                 wave.clearGraph()
 
     def calculateUpdateSpeed(self):
-        self.data_processing.speed = self.speedControl.value() / 4
+        # Live sessions always follow the real time
+        if self.data_processing is None or not isinstance(self.data_processing.data_source, PlaybackManager):
+            return
+        if self.actionUnthrottledPlayback.isChecked():
+            if not isinstance(self.data_processing.clock, UnthrottledClock):
+                self.data_processing.set_clock(UnthrottledClock())
+        elif isinstance(self.data_processing.clock, ScaledClock):
+            self.data_processing.clock.speed = self.speedControl.value() / 4
+        else:
+            self.data_processing.set_clock(ScaledClock(self.speedControl.value() / 4))
 
     # Function that updates plot data
     def update(self):
-        data_source = self.data_processing.data_source
-        if data_source.is_finished():
-            self.stopLoop()
-            self.playButton.setIcon(self.playIcon)
-            self.playButton.setEnabled(False)
+        start_time = time.perf_counter()
+        with monitor.measure("update"):
+            drawn = self.updatePlots()
+        if not drawn:
             return
-
-        _, wave, fft = self.data_processing.forward()
-        if wave is None or fft is None:
+        # Qt paints the curves after update() returns, the paints since the previous frame are part of its cost
+        cost = time.perf_counter()-start_time+paint_timer.pop()
+        if self.governor.record(cost):
+            self.applyGovernor()
+
+    def applyGovernor(self):
+        # Skipped single waves are cleared instead of showing old data
+        if self.governor.skip_single_waves and self.singleWaves is not None:
+            for wave in self.singleWaves:
+                wave.clearGraph()
+        if self.timer is not None:
+            self.timer.setInterval(self.governor.get_interval())
+
+    def updatePlots(self):
+        frame = self.frames.get_latest()
+        if frame is None:
+            if self.worker is not None and self.worker.finished:
+                self.stopLoop()
+                self.playButton.setIcon(self.playIcon)
+                self.playButton.setEnabled(False)
             return
+        monitor.tick()
+        self.showStatus()
+        self.updateTimeline()
+        wave = frame.wave
+        fft = frame.fft
+
+        # The spectrum is recomputed once per hop, the same functions are returned in between
+        fft_changed = fft is not None and fft is not self.lastFft
+        self.lastFft = fft
+        if fft_changed:
+            if self.eeg_ecg_mode.isChecked():
+                fft, _ = self.splitWaves(fft)
+            self.fftWidget.refresh(fft, scale_fn=decibel_scale)
+        self.updateSpectrogram()
+
+        if wave is not None:
+            self.updateWaves(wave)
+            self.latencyFrame = frame
+        return True
 
+    def updateWaves(self, wave):
         if self.eeg_ecg_mode.isChecked():
             eeg_wave, ecg_wave = self.splitWaves(wave)
-            eeg_fft, _ = self.splitWaves(fft)
             self.waveWidget.refresh(eeg_wave)
-            self.fftWidget.refresh(eeg_fft, scale_fn=decibel_scale)
             self.ecgWidget.refresh(ecg_wave)
         else:
             self.waveWidget.refresh(wave)
-            self.fftWidget.refresh(fft, scale_fn=decibel_scale)
 
-        for i, w in enumerate(wave):
-            self.singleWaves[i].refresh([w])
+        if self.governor.skip_single_waves:
+            return
+        # Single waves of the visible channels are decimated all together
+        visible = [i for i in range(len(wave)) if len(wave[i].y) > 0 and
+                   self.singleWaves[i].isVisible() and self.singleWaves[i].isPlotVisible()]
+        if len(visible) > 0:
+            single_waves = decimate_functions([wave[i] for i in visible], self.singleWaves[visible[0]].width())
+            for i, w in zip(visible, single_waves):
+                self.singleWaves[i].refresh([w])
+
+    def updateSpectrogram(self):
+        # Only the spectrum columns of the hops since the last frame are drawn
+        if not self.spectrogramWindow.isVisible():
+            return
+        columns = self.data_processing.get_spectrogram_columns()
+        if len(columns) > 0:
+            self.spectrogramWindow.add_columns(columns, self.data_processing.spectrum.freq,
+                                               self.data_processing.get_spectrogram_hop())
+
+    def recordLatency(self):
+        # Time from the board timestamp of the newest sample to the painting of the wave graph,
+        # recorded timestamps of a playback are not comparable with the clock
+        frame = self.latencyFrame
+        self.latencyFrame = None
+        if frame is None or frame.timestamp is None or self.data_processing is None:
+            return
+        data_source = self.data_processing.data_source
+        if not isinstance(data_source, Board):
+            return
+        latency = time.time()-frame.timestamp
+        monitor.record("latency", latency)
+        data_source.logger.write_latency(frame.timestamp, latency)
+
+    def showStatus(self):
+        # The status bar is refreshed twice per second
+        if time.monotonic()-self.statusTime < 0.5:
+            return
+        self.statusTime = time.monotonic()
+
+        text = f"Dropped frames: {self.frames.dropped}"
+        data_source = self.data_processing.data_source
+        if isinstance(data_source, Board):
+            stats = data_source.logger.get_stats()
+            if stats is not None:
+                text += f"   Write queue: {stats['queue_depth']}   Recording: {stats['bytes_per_sec']/1024:.1f} KiB/s"
+            latency = monitor.get_stats().get("latency")
+            if latency is not None:
+                text += f"   Latency: {latency['p50']:.0f} ms (p95 {latency['p95']:.0f} ms)"
+        if self.eeg_ecg_mode.isChecked():
+            for ch, (heart_rate, hrv) in self.data_processing.get_heart_rates().items():
+                if heart_rate is not None:
+                    text += f"   ECG {ch}: {heart_rate:.0f} bpm"
+                    if hrv is not None:
+                        text += f" (RMSSD {hrv:.0f} ms)"
+        if self.governor.is_reduced():
+            text += f"   Reduced rendering: {self.governor.frame_rate} Hz"
+            if self.governor.skip_single_waves:
+                text += ", single channels paused"
+        if self.actionPerformance.isChecked():
+            text += f"   FPS: {monitor.get_fps():.1f}   Backlog: {data_source.get_backlog()}"
+            for stage, stats in monitor.get_stats().items():
+                text += f"   {stage}: {stats['p50']:.1f}/{stats['p95']:.1f}/{stats['max']:.1f} ms"
+        if text != self.statusText:
+            self.statusText = text
+            self.statusBar().showMessage(text)
+
+    # Methods for performance monitoring
+    def togglePerformanceOverlay(self, checked):
+        monitor.reset()
+        self.statusTime = 0
+
+    def savePerformanceReport(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Performance Report", "performance.json", "JSON (*.json)")
+        if path != "":
+            monitor.dump(path)
+
+    # Methods for playback timeline
+    def initTimeline(self):
+        data_source = self.data_processing.data_source
+        if not isinstance(data_source, PlaybackManager):
+            return
+        self.timelineSlider.blockSignals(True)
+        self.timelineSlider.setRange(0, max(0, data_source.get_length()-1))
+        self.timelineSlider.blockSignals(False)
+        self.timelineSlider.setEnabled(True)
+        self.updateTimeline()
+
+    def resetTimeline(self):
+        self.timelineSlider.blockSignals(True)
+        self.timelineSlider.setValue(0)
+        self.timelineSlider.blockSignals(False)
+        self.timelineSlider.setEnabled(False)
+        self.timelineLabel.setText("00:00 / 00:00")
+
+    def updateTimeline(self):
+        data_source = self.data_processing.data_source
+        if not isinstance(data_source, PlaybackManager) or self.timelineSlider.isSliderDown():
+            return
+        self.timelineSlider.blockSignals(True)
+        self.timelineSlider.setValue(data_source.get_position())
+        self.timelineSlider.blockSignals(False)
+        self.updateTimelineLabel(data_source.get_position())
+
+    def updateTimelineLabel(self, position):
+        sampling_rate = self.data_processing.sampling_rate
+        length = self.data_processing.data_source.get_length()
+        self.timelineLabel.setText(f"{formatTime(position/sampling_rate)} / {formatTime(length/sampling_rate)}")
+
+    def seekPlayback(self):
+        data_source = self.data_processing.data_source
+        if not isinstance(data_source, PlaybackManager):
+            return
+
+        position = self.timelineSlider.value()
+        impedance, wave, fft = self.data_processing.seek(position)
+        self.spectrogramWindow.reset()
+        self.updateTimelineLabel(position)
+        self.playButton.setEnabled(not data_source.is_finished())
+        if wave is not None:
+            self.frames.put(Frame(impedance, wave, fft, self.data_processing.timestamp))
+            # When paused the new position is drawn immediately
+            if self.worker is None:
+                self.update()
 
     @classmethod
     def splitWaves(cls, waves):
@@ -182,19 +371,23 @@ class MainWindow(QMainWindow):
 
     # some methods of MainWindow
     def showFileManager(self):
-        self.fileManager.showFileBrowser()
+        self.fileManager.showFileBrowser(self.outputDirectory.text())
         if len(self.fileManager.getFilename()) > 0:
             self.initSession()
 
     def initSession(self):
         self.closeSession()
+        single_precision = self.actionSinglePrecision.isChecked()
+        dtype = np.float32 if single_precision else np.float64
         if self.liveRadioBtn.isChecked():
             output_folder = self.outputDirectory.text()
             self.setCursor(QtGui.QCursor(QtCore.Qt.CursorShape.WaitCursor))
             board_type = type_of_board.get(self.inputBoard.currentText())
             port = serial_port_connected.get(self.serialPortInput.currentText())
+            record_format = record_formats.get(self.recordFormat.currentText())
             try:
-                data_source = Board(board_type, port, output_folder)
+                record_dtype = float32_dtype if single_precision else binary_dtype
+                data_source = Board(board_type, port, output_folder, record_format, record_dtype)
 
                 patientName = self.patientName.text()
                 patientSurname = self.patientSurname.text()
@@ -202,7 +395,7 @@ class MainWindow(QMainWindow):
                 if patientName != "" or patientSurname != "" or patientDescription != "":
                     data_source.logger.save_metadata([patientName, patientSurname, patientDescription])
 
-                self.data_processing = DataProcessing(data_source)
+                self.data_processing = DataProcessing(data_source, dtype=dtype)
                 self.imp_ui = ImpedanceUI(data_source)
                 self.impCheckBtn.setEnabled(True)
             except BrainFlowError:
@@ -231,14 +424,27 @@ class MainWindow(QMainWindow):
                 self.patientSurname.setText(metadata[1])
                 self.patientDescription.setPlainText(metadata[2])
 
-            self.data_processing = DataProcessing(data_source)
+            self.data_processing = DataProcessing(data_source, dtype=dtype)
             self.speedControl.setEnabled(True)
+            # CSV lengths are estimated when the catalog indexes folders of older versions
+            update_catalog_length(input_path, data_source.board_id, data_source.get_length())
+
+        # Only the channels of the board are shown, the ECG mode needs channels 9-11
+        num_channels = len(self.data_processing.exg_channels)
+        self.channels = range(1, num_channels+1)
+        has_ecg = len(get_ecg_channels(num_channels)) > 0
+        if not has_ecg and self.eeg_ecg_mode.isChecked():
+            self.eeg_ecg_mode.setChecked(False)
+        self.eeg_ecg_mode.setEnabled(has_ecg)
+        for ch in exg_channels:
+            ecg_row = self.eeg_ecg_mode.isChecked() and ch in ecg_channels
+            self.findChild(QWidget, "singleCH{}_2".format(ch)).setVisible(ch in self.channels and not ecg_row)
 
         # EEG/ECG Single Waves Instructions
         if self.singleWaves is None:
             resizer = Resizer()
             self.singleWaves = []
-            for ch in exg_channels:
+            for ch in self.channels:
                 graph = Graph(resizer)
                 graph.showAxes(True, size=(0, 0))
                 graph.setXRange(-self.data_processing.window_size, 0)
@@ -249,12 +455,14 @@ class MainWindow(QMainWindow):
                 else:
                     self.findChild(QHBoxLayout, "singleCH{}".format(ch)).addWidget(graph)
 
+        self.spectrogramWindow.set_channels(self.channels)
+
         # Wave Plot Instructions
-        self.initGraph(self.waveWidget, exg_channels)
+        self.initGraph(self.waveWidget, self.channels)
         self.waveWidget.setXRange(-self.data_processing.window_size, 0)
 
         # FFT Plot Instructions
-        self.initGraph(self.fftWidget, exg_channels)
+        self.initGraph(self.fftWidget, self.channels)
         self.fftWidget.setXRange(0, 60)
 
         # ECG Plot Instructions
@@ -262,6 +470,7 @@ class MainWindow(QMainWindow):
         self.ecgWidget.setXRange(-self.data_processing.window_size, 0)
 
         self.showSessionWidgets()
+        self.updateOutputs()
         self.playButton.setIcon(self.playIcon)
         self.playButton.setEnabled(True)
         self.stopButton.setEnabled(False)
@@ -293,6 +502,7 @@ class MainWindow(QMainWindow):
         self.waveWidget.reset()
         self.fftWidget.reset()
         self.ecgWidget.reset()
+        self.spectrogramWindow.reset()
         if self.singleWaves is not None:
             for i, wave in enumerate(self.singleWaves):
                 self.findChild(QHBoxLayout, "singleCH{}".format(i + 1)).removeWidget(wave)
@@ -332,6 +542,7 @@ class MainWindow(QMainWindow):
                 self.fftWidget.lightTheme()
             if self.ecgWidget is not None:
                 self.ecgWidget.lightTheme()
+            self.spectrogramWindow.lightTheme()
             self.darkTheme = False
 
     def darkMode(self):
@@ -347,6 +558,7 @@ class MainWindow(QMainWindow):
                 self.fftWidget.darkTheme()
             if self.ecgWidget is not None:
                 self.ecgWidget.darkTheme()
+            self.spectrogramWindow.darkTheme()
             self.darkTheme = True
 
     def toggleChannel(self, checked):
@@ -354,6 +566,7 @@ class MainWindow(QMainWindow):
 
         if isinstance(self.data_processing.data_source, Board):
             self.data_processing.data_source.toggle_channel(ch, checked)
+        self.data_processing.set_channel_active(ch, checked)
 
         if checked:
             self.singleWaves[ch - 1].showPlot()
@@ -371,8 +584,8 @@ class MainWindow(QMainWindow):
                 self.fftWidget.hidePlot(ch)
 
     def toggleAllChannels(self, checked):
-        self.checkChannels(exg_channels, "CH{}check", checked)
-        self.checkChannels(ecg_channels, "ECGCH{}check", checked)
+        self.checkChannels(self.channels, "CH{}check", checked)
+        self.checkChannels(get_ecg_channels(len(self.channels)), "ECGCH{}check", checked)
 
     def checkChannels(self, channel_range, name_format, checked):
         for ch in channel_range:
@@ -382,6 +595,7 @@ class MainWindow(QMainWindow):
 
     # Methods for Show/Hide plot
     def show_hide_wave(self, state):
+        self.updateOutputs()
         if state == 2:
             self.waveMainContainer.show()
             self.showSidebar()
@@ -391,6 +605,7 @@ class MainWindow(QMainWindow):
                 self.hideSessionWidgets()
 
     def show_hide_fft(self, state):
+        self.updateOutputs()
         if state == 2:
             self.fftMainContainer.show()
             self.showSidebar()
@@ -403,6 +618,7 @@ class MainWindow(QMainWindow):
         if not self.mainViewGroup.isEnabled():
             return
 
+        self.updateOutputs()
         if state == 2:
             self.ecgMainContainer.show()
             self.showSidebar()
@@ -412,6 +628,23 @@ class MainWindow(QMainWindow):
             if not self.wavePlotCheckBox.isChecked() and not self.fftPlotCheckBox.isChecked():
                 self.hideSessionWidgets()
 
+    def updateOutputs(self):
+        # Only the outputs of the shown views are computed
+        if self.data_processing is None:
+            return
+        outputs = set()
+        if self.wavePlotCheckBox.isChecked() or self.fftPlotCheckBox.isChecked() or self.ecgPlotCheckBox.isChecked():
+            outputs.add(wave_output)
+        if self.fftPlotCheckBox.isChecked():
+            outputs.add(fft_output)
+        if self.spectrogramWindow.isVisible():
+            outputs.add(spectrogram_output)
+        if self.eeg_ecg_mode.isChecked():
+            outputs.add(ecg_output)
+        if self.actionBandPower.isChecked():
+            outputs.add(band_power_output)
+        self.data_processing.set_outputs(outputs)
+
     def showSidebar(self):
         self.allChannelCheck.show()
         self.eeg_channels.show()
@@ -440,11 +673,20 @@ class MainWindow(QMainWindow):
             self.controlButtonsLayout.addWidget(self.stopButton)
             self.speedControlLayout.addWidget(self.speedControl)
 
+    def showSpectrogram(self):
+        # No columns are computed while the window is closed, it restarts empty
+        if not self.spectrogramWindow.isVisible():
+            self.spectrogramWindow.reset()
+        self.spectrogramWindow.show()
+        self.spectrogramWindow.raise_()
+        self.updateOutputs()
+
     def show_impedance_detector(self):
         self.stop()
         self.imp_ui.show()
 
     def on_off_ecg(self, checked):
+        self.updateOutputs()
         if checked:
             self.ecgPlotCheckBox.setEnabled(True)
             self.ecgPlotCheckBox.setChecked(True)
@@ -482,14 +724,28 @@ class MainWindow(QMainWindow):
 
     # Methods for loop
     def startLoop(self):
+        self.frames.clear()
+        self.worker = AcquisitionWorker(self.data_processing, self.frames)
+        self.worker.start()
+
+        self.governor.reset()
+        paint_timer.pop()
         self.timer = QtCore.QTimer()
-        self.timer.setInterval(1000//60)
+        self.timer.setInterval(self.governor.get_interval())
         self.timer.timeout.connect(self.update)
         self.timer.start()
 
     def stopLoop(self):
         if self.timer is not None:
             self.timer.stop()
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+
+def formatTime(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
 
 
 # ****************************************** - - - Main block - - - *****************************************#
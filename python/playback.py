@@ -3,10 +3,10 @@ from data_source import DataSource
 
 
 class PlaybackManager(DataSource):
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache=True):
         super().__init__()
         self.file_path = file_path
-        self.parser = LogParser(self.file_path)
+        self.parser = LogParser(self.file_path, cache)
         self.board_id = self.parser.board_id
 
     def start(self):
@@ -21,6 +21,21 @@ class PlaybackManager(DataSource):
     def read_data(self, samples=1):
         return self.parser.read_data(samples)
 
+    def get_exg_channels(self):
+        return self.parser.get_exg_channels()
+
+    def get_position(self):
+        return self.parser.position
+
+    def get_length(self):
+        return self.parser.get_length()
+
+    def seek(self, index):
+        self.parser.seek(index)
+
+    def find_time(self, timestamp):
+        return self.parser.find_time(timestamp)
+
     def is_finished(self):
         return not self.parser.has_new_data
 
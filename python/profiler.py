@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Number of measurements kept for each stage
+history_size = 300
+
+
+class PerformanceMonitor:
+    """
+    Rolling timings of the pipeline stages (acquisition, filtering, PSD,
+    logging, plotting) and of the rendered frames.
+    """
+    def __init__(self, size=history_size):
+        self.size = size
+        self.enabled = True
+        self.stages = {}
+        self.frames = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter()-start_time)
+
+    def record(self, stage, duration):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = deque(maxlen=self.size)
+            self.stages[stage].append(duration)
+
+    def tick(self):
+        """ Marks a rendered frame """
+        with self.lock:
+            self.frames.append(time.perf_counter())
+
+    def get_fps(self):
+        with self.lock:
+            if len(self.frames) < 2 or self.frames[-1] == self.frames[0]:
+                return 0.0
+            return (len(self.frames)-1)/(self.frames[-1]-self.frames[0])
+
+    def get_stats(self):
+        """ Returns p50, p95 and max duration in milliseconds of every stage """
+        with self.lock:
+            stages = {stage: np.array(durations)*1000 for stage, durations in self.stages.items() if len(durations) > 0}
+        return {stage: {
+            "p50": float(np.percentile(durations, 50)),
+            "p95": float(np.percentile(durations, 95)),
+            "max": float(np.max(durations)),
+            "count": len(durations)
+        } for stage, durations in stages.items()}
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            json.dump({"fps": self.get_fps(), "stages": self.get_stats()}, file, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.frames.clear()
+
+
+# Shared by all the pipeline stages
+monitor = PerformanceMonitor()
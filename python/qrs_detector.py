@@ -0,0 +1,199 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from streaming_filter import StreamingFilter, bandpass_sos
+
+# Pan-Tompkins configuration: QRS band-pass, integration window and refractory period
+qrs_band = (5.0, 15.0)
+qrs_filter_order = 2
+integration_window = 0.150
+refractory_period = 0.200
+
+# Peaks within this time from a beat, with less than half its slope, are T waves
+t_wave_period = 0.360
+
+# Seconds of signal used to learn the initial signal and noise levels,
+# they are learned again after `relearn_period` seconds without beats (e.g. after an artifact)
+learning_period = 2.0
+relearn_period = 3.0
+
+# RR intervals used for the heart rate and the HRV
+rr_history = 8
+
+# Without beats for this many mean RR intervals, the highest discarded peak is searched back
+searchback_ratio = 1.66
+
+
+class QRSDetector:
+    """
+    Streaming Pan-Tompkins QRS detector. The new samples of each block go through
+    the band-pass filter, derivative, squaring and moving window integration, and
+    the peaks of the integrated signal are classified as beats or noise with
+    adaptive thresholds. Only a few samples of each stage are kept between blocks.
+    """
+    def __init__(self, num_channels, sampling_rate):
+        self.num_channels = num_channels
+        self.sampling_rate = sampling_rate
+        self.filter = StreamingFilter(num_channels, sampling_rate,
+                                      sos=bandpass_sos(qrs_filter_order, *qrs_band, sampling_rate))
+        self.window = max(1, int(round(integration_window*sampling_rate)))
+        self.refractory = int(refractory_period*sampling_rate)
+        self.t_wave = int(t_wave_period*sampling_rate)
+        self.learning_samples = max(1, int(learning_period*sampling_rate))
+        self.relearn_samples = int(relearn_period*sampling_rate)
+        # The R wave is searched in the input samples of the integration window before each peak,
+        # also covering the delay of the band-pass filter (where its impulse response peaks)
+        impulse = np.zeros((num_channels, int(sampling_rate)))
+        impulse[:, 0] = 1
+        delay = int(np.argmax(np.abs(self.filter.process(impulse)[0])))
+        self.search_length = self.window+2+delay
+        self.reset()
+
+    def reset(self):
+        self.filter.reset()
+        self.input_tail = None
+        self.filtered_tail = np.zeros((self.num_channels, self.search_length))
+        self.derivative_input = np.zeros((self.num_channels, 4))
+        self.squared_tail = np.zeros((self.num_channels, self.window-1))
+        self.integrated_tail = np.zeros((self.num_channels, 2))
+        self.sample_count = 0
+        self.learning_end = np.full(self.num_channels, self.learning_samples)
+        self.learning_max = np.zeros(self.num_channels)
+        self.learning_sum = np.zeros(self.num_channels)
+        self.signal_level = np.zeros(self.num_channels)
+        self.noise_level = np.zeros(self.num_channels)
+        self.last_beat = [None]*self.num_channels
+        self.last_r_wave = [None]*self.num_channels
+        self.last_slope = np.zeros(self.num_channels)
+        # Highest peak discarded since the last beat, (sample, r_wave, slope, peak)
+        self.candidate = [None]*self.num_channels
+        self.rr = [deque(maxlen=rr_history) for _ in range(self.num_channels)]
+
+    def process(self, block):
+        """
+        Processes a channel-major block of new samples. Returns the beats found as
+        (channel, sample, rr) tuples, where `sample` counts from the first sample
+        processed and `rr` is the interval from the previous beat in seconds.
+        """
+        samples = block.shape[1]
+        if samples == 0:
+            return []
+        if self.input_tail is None:
+            self.input_tail = np.repeat(block[:, :1], self.search_length, axis=1)
+        history = np.concatenate((self.input_tail, block), axis=1)
+        self.input_tail = history[:, -self.search_length:]
+        filtered = self.filter.process(block)
+        filtered_history = np.concatenate((self.filtered_tail, filtered), axis=1)
+        self.filtered_tail = filtered_history[:, -self.search_length:]
+
+        # Five-point derivative and squaring
+        x = np.concatenate((self.derivative_input, filtered), axis=1)
+        self.derivative_input = x[:, -4:]
+        squared = ((2*x[:, 4:]+x[:, 3:-1]-x[:, 1:-3]-2*x[:, :-4])*(self.sampling_rate/8))**2
+
+        # Moving window integration, as a difference of cumulative sums
+        squared = np.concatenate((self.squared_tail, squared), axis=1)
+        self.squared_tail = squared[:, squared.shape[1]-(self.window-1):]
+        cumulative = np.zeros((self.num_channels, squared.shape[1]+1))
+        np.cumsum(squared, axis=1, out=cumulative[:, 1:])
+        integrated = (cumulative[:, self.window:]-cumulative[:, :-self.window])/self.window
+
+        # Initial levels from the maximum and mean of the first seconds
+        for channel in np.nonzero(self.learning_end > self.sample_count)[0]:
+            learning = min(samples, self.learning_end[channel]-self.sample_count)
+            self.learning_max[channel] = max(self.learning_max[channel], np.max(integrated[channel, :learning]))
+            self.learning_sum[channel] += np.sum(integrated[channel, :learning])
+            if self.sample_count+learning == self.learning_end[channel]:
+                self.signal_level[channel] = self.learning_max[channel]/3
+                self.noise_level[channel] = self.learning_sum[channel]/self.learning_samples/2
+
+        # Local maxima, the last sample of the previous block is checked with the new ones
+        extended = np.concatenate((self.integrated_tail, integrated), axis=1)
+        self.integrated_tail = extended[:, -2:]
+        middle = extended[:, 1:-1]
+        is_peak = (middle > extended[:, :-2]) & (middle >= extended[:, 2:])
+
+        beats = []
+        for channel, k in zip(*np.nonzero(is_peak)):
+            sample = self.sample_count+k-1
+            if sample >= self.learning_end[channel]:
+                # The R wave is the largest deviation from the mean in the samples before the peak,
+                # the slope of the QRS is measured on the filtered samples
+                end = k-1+self.search_length+1
+                search = history[channel, end-self.search_length:end]
+                r_wave = sample-self.search_length+1+int(np.argmax(np.abs(search-np.mean(search))))
+                slope = np.max(np.abs(np.diff(filtered_history[channel, end-self.search_length:end])))
+                self.classify(channel, sample, r_wave, slope, middle[channel, k], beats)
+        self.sample_count += samples
+
+        for channel in range(self.num_channels):
+            last = self.learning_end[channel] if self.last_beat[channel] is None else \
+                max(self.last_beat[channel], self.learning_end[channel])
+            if self.sample_count-last > self.relearn_samples:
+                self.relearn(channel)
+        beats.sort(key=lambda beat: beat[1])
+        return beats
+
+    def relearn(self, channel):
+        self.learning_end[channel] = self.sample_count+self.learning_samples
+        self.learning_max[channel] = 0
+        self.learning_sum[channel] = 0
+        self.candidate[channel] = None
+
+    def classify(self, channel, sample, r_wave, slope, peak, beats):
+        threshold = self.noise_level[channel]+0.25*(self.signal_level[channel]-self.noise_level[channel])
+        last = self.last_beat[channel]
+        rr = self.rr[channel]
+
+        # A missed beat is taken from the discarded peaks with half the threshold
+        if self.candidate[channel] is not None and len(rr) > 0 and \
+                sample-last > searchback_ratio*np.mean(rr)*self.sampling_rate:
+            candidate_sample, candidate_r_wave, candidate_slope, candidate_peak = self.candidate[channel]
+            self.candidate[channel] = None
+            if candidate_peak > threshold/2:
+                self.signal_level[channel] = 0.25*candidate_peak+0.75*self.signal_level[channel]
+                self.add_beat(channel, candidate_sample, candidate_r_wave, candidate_slope, beats)
+                last = candidate_sample
+
+        if last is not None:
+            elapsed = r_wave-self.last_r_wave[channel]
+            if elapsed < self.refractory:
+                return
+            is_t_wave = elapsed < self.t_wave and slope < self.last_slope[channel]/2
+        else:
+            is_t_wave = False
+        if peak > threshold and not is_t_wave:
+            self.signal_level[channel] = 0.125*peak+0.875*self.signal_level[channel]
+            self.add_beat(channel, sample, r_wave, slope, beats)
+        else:
+            self.noise_level[channel] = 0.125*peak+0.875*self.noise_level[channel]
+            if not is_t_wave and (self.candidate[channel] is None or peak > self.candidate[channel][3]):
+                self.candidate[channel] = (sample, r_wave, slope, peak)
+
+    def add_beat(self, channel, sample, r_wave, slope, beats):
+        # Peaks of the integrated signal time the search back, R waves the RR intervals
+        rr = None
+        if self.last_beat[channel] is not None:
+            rr = (r_wave-self.last_r_wave[channel])/self.sampling_rate
+            self.rr[channel].append(rr)
+        self.last_beat[channel] = sample
+        self.last_r_wave[channel] = r_wave
+        self.last_slope[channel] = slope
+        self.candidate[channel] = None
+        beats.append((channel, r_wave, rr))
+
+    def get_heart_rate(self, channel):
+        """ Mean heart rate of the last RR intervals in beats per minute, None before two beats """
+        rr = self.rr[channel]
+        if len(rr) == 0:
+            return None
+        return 60/np.mean(rr)
+
+    def get_hrv(self, channel):
+        """ RMSSD of the last RR intervals in milliseconds, None before three beats """
+        rr = self.rr[channel]
+        if len(rr) < 2:
+            return None
+        return 1000*math.sqrt(np.mean(np.diff(rr)**2))
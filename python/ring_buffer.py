@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity, channel-major circular buffer.
+
+    Samples are stored twice (in two mirrored halves of the same array) so the
+    latest N samples are always available as a contiguous view, without copies.
+    """
+    def __init__(self, num_channels, capacity, dtype=np.float64):
+        self.num_channels = num_channels
+        self.capacity = capacity
+        self.data = np.zeros((num_channels, 2*capacity), dtype=dtype)
+        self.head = 0
+        self.written = 0
+
+    def reset(self, value=0):
+        self.data.fill(value)
+        self.head = 0
+        self.written = 0
+
+    def write(self, block):
+        """ Appends a channel-major block of shape (num_channels, samples) """
+        samples = block.shape[1]
+        if samples == 0:
+            return
+        if samples > self.capacity:
+            block = block[:, -self.capacity:]
+            samples = self.capacity
+
+        first = min(samples, self.capacity-self.head)
+        self._write_mirrored(self.head, block[:, :first])
+        if first < samples:
+            self._write_mirrored(0, block[:, first:])
+
+        self.head = (self.head+samples) % self.capacity
+        self.written += samples
+
+    def _write_mirrored(self, start, block):
+        end = start+block.shape[1]
+        self.data[:, start:end] = block
+        self.data[:, start+self.capacity:end+self.capacity] = block
+
+    def latest(self, samples=None):
+        """ Returns a view of the latest samples, oldest first """
+        if samples is None or samples > self.capacity:
+            samples = self.capacity
+        end = self.head+self.capacity
+        return self.data[:, end-samples:end]
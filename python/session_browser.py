@@ -0,0 +1,74 @@
+import os
+
+from PyQt5 import uic
+from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QTableWidgetItem
+from brainflow.board_shim import BoardIds
+
+from log_manager import SessionCatalog
+
+separator = os.path.sep
+
+# Records shown at most for a search
+max_results = 1000
+
+# Result of the dialog when the user asks for the file dialog
+browse_result = 2
+
+
+class SessionBrowser(QDialog):
+    """ Searches the records of an output directory in its session catalog """
+    def __init__(self, root, parent=None):
+        super().__init__(parent)
+        uic.loadUi(f"..{separator}GUI{separator}sessionBrowserGUI.ui", self)
+        self.catalog = SessionCatalog(root)
+        self.records = []
+        self.path = ""
+
+        self.searchInput.textChanged.connect(self.search)
+        self.resultsTable.itemSelectionChanged.connect(self.update_buttons)
+        self.resultsTable.cellDoubleClicked.connect(lambda row, column: self.accept())
+        self.browseButton.clicked.connect(lambda: self.done(browse_result))
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+        # Folders written without the catalog are indexed once, then only the new ones
+        self.catalog.scan()
+        self.search()
+
+    def search(self):
+        self.records = self.catalog.search(self.searchInput.text(), max_results)
+        self.resultsTable.setRowCount(len(self.records))
+        for row, record in enumerate(self.records):
+            subject = " ".join(name for name in (record["name"], record["surname"]) if name != "")
+            try:
+                board = BoardIds(record["board_id"]).name
+            except ValueError:
+                board = str(record["board_id"])
+            minutes, seconds = divmod(int(record["duration"]), 60)
+            values = [subject, record["start_time"], board, str(len(record["exg_channels"])),
+                      f"{minutes}:{seconds:02d}", os.path.relpath(record["path"], self.catalog.root)]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column == 0 and record["description"] != "":
+                    item.setToolTip(record["description"])
+                self.resultsTable.setItem(row, column, item)
+        self.resultsTable.resizeColumnsToContents()
+        more = " (refine the search to see the others)" if len(self.records) == max_results else ""
+        self.countLabel.setText(f"{len(self.records)} records{more}")
+        if len(self.records) > 0:
+            self.resultsTable.selectRow(0)
+        self.update_buttons()
+
+    def update_buttons(self):
+        selected = len(self.resultsTable.selectionModel().selectedRows()) > 0
+        self.buttonBox.button(QDialogButtonBox.Open).setEnabled(selected)
+
+    def accept(self):
+        rows = self.resultsTable.selectionModel().selectedRows()
+        if len(rows) == 0:
+            return
+        self.path = self.records[rows[0].row()]["path"]
+        super().accept()
+
+    def get_path(self):
+        return self.path
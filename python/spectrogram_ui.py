@@ -0,0 +1,46 @@
+import os
+
+from PyQt5 import uic, QtCore, QtGui
+from PyQt5.QtWidgets import QWidget
+
+from graph import Spectrogram
+
+separator = os.path.sep
+
+
+class SpectrogramUI(QWidget):
+    # Emitted when the window is closed or hidden, the spectrum columns are no longer needed
+    hidden = QtCore.pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        uic.loadUi(f"..{separator}GUI{separator}spectrogramGUI.ui", self)
+
+        self.graph = Spectrogram()
+        self.spectrogramContainer.addWidget(self.graph)
+        self.channelSelect.currentIndexChanged.connect(self.select_channel)
+
+    def set_channels(self, channels):
+        self.channelSelect.clear()
+        for ch in channels:
+            self.channelSelect.addItem(f"Channel {ch}")
+
+    def select_channel(self, index):
+        if index >= 0:
+            self.graph.setChannel(index)
+
+    def add_columns(self, columns, freq, hop):
+        self.graph.addColumns(columns, freq, hop)
+
+    def reset(self):
+        self.graph.reset()
+
+    def lightTheme(self):
+        self.graph.lightTheme()
+
+    def darkTheme(self):
+        self.graph.darkTheme()
+
+    def hideEvent(self, event: QtGui.QHideEvent) -> None:
+        super().hideEvent(event)
+        self.hidden.emit()
@@ -0,0 +1,62 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Default spectral settings: recompute every 125 ms, a single segment (no Welch averaging)
+default_hop = 0.125
+default_averages = 1
+overlap_percentage = 0.75
+
+
+def nearest_power_of_two(value):
+    return 2**int(round(math.log2(value)))
+
+
+class SpectralEstimator:
+    """
+    Power Spectrum Density of all channels at once.
+
+    The spectrum is recomputed only once every `hop` seconds of new data, averaging
+    `averages` overlapping Hamming-windowed segments (Welch method); in between
+    the last result is kept.
+    """
+    def __init__(self, sampling_rate, max_samples, hop=default_hop, averages=default_averages,
+                 nfft=None, dtype=np.float64):
+        self.sampling_rate = sampling_rate
+        self.nfft = nearest_power_of_two(sampling_rate) if nfft is None else nfft
+        self.step = max(1, int(self.nfft*(1-overlap_percentage)))
+        self.hop_samples = max(1, int(round(hop*sampling_rate)))
+        max_averages = (max_samples-self.nfft)//self.step+1
+        self.averages = max(1, min(averages, max_averages))
+        # Periodic Hamming window and scaling as in DataFilter.get_psd
+        self.window = np.hamming(self.nfft+1)[:-1].astype(dtype)
+        self.scale = 1/(sampling_rate*self.nfft)
+        self.freq = np.fft.rfftfreq(self.nfft, 1/sampling_rate)
+        self.power = None
+        self.pending_samples = 0
+
+    def reset(self):
+        self.power = None
+        self.pending_samples = 0
+
+    def update(self, new_samples, data):
+        """
+        Accounts for new samples and recomputes the spectrum of the channel-major
+        window `data` when a hop has elapsed. Returns True if the spectrum changed.
+        """
+        self.pending_samples += new_samples
+        if self.power is not None and self.pending_samples < self.hop_samples:
+            return False
+        self.pending_samples = 0
+        self.power = self.compute(data)
+        return True
+
+    def compute(self, data):
+        required = self.nfft+(self.averages-1)*self.step
+        segments = sliding_window_view(data[:, -required:], self.nfft, axis=1)[:, ::self.step]
+        segments = segments-np.mean(segments, axis=-1, keepdims=True)
+        spectrum = np.fft.rfft(segments*self.window, axis=-1)
+        power = (spectrum.real**2+spectrum.imag**2)*self.scale
+        power[..., 1:-1] *= 2
+        return np.mean(power, axis=1).astype(self.window.dtype, copy=False)
@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+
+# Filter configuration, equivalent to the previous BrainFlow chain:
+# 4th order Butterworth low-pass at 45 Hz followed by 50 Hz and 60 Hz band-stops
+lowpass_cutoff = 45.0
+lowpass_order = 4
+notch_frequencies = [50.0, 60.0]
+notch_bandwidth = 4.0
+
+
+def butterworth_lowpass_sos(order, cutoff, sampling_rate):
+    # Bilinear transform of the analog Butterworth prototype, one biquad per pole pair
+    w0 = 2*math.pi*cutoff/sampling_rate
+    cos_w0 = math.cos(w0)
+    sections = []
+    for k in range(order//2):
+        q = 1/(2*math.cos(math.pi*(2*k+1)/(2*order)))
+        alpha = math.sin(w0)/(2*q)
+        b = [(1-cos_w0)/2, 1-cos_w0, (1-cos_w0)/2]
+        a = [1+alpha, -2*cos_w0, 1-alpha]
+        sections.append(normalize_section(b, a))
+    return sections
+
+
+def butterworth_highpass_sos(order, cutoff, sampling_rate):
+    w0 = 2*math.pi*cutoff/sampling_rate
+    cos_w0 = math.cos(w0)
+    sections = []
+    for k in range(order//2):
+        q = 1/(2*math.cos(math.pi*(2*k+1)/(2*order)))
+        alpha = math.sin(w0)/(2*q)
+        b = [(1+cos_w0)/2, -(1+cos_w0), (1+cos_w0)/2]
+        a = [1+alpha, -2*cos_w0, 1-alpha]
+        sections.append(normalize_section(b, a))
+    return sections
+
+
+def bandpass_sos(order, low, high, sampling_rate):
+    # Butterworth high-pass and low-pass of the same order in cascade
+    sections = butterworth_highpass_sos(order, low, sampling_rate)
+    sections.extend(butterworth_lowpass_sos(order, high, sampling_rate))
+    return np.array(sections)
+
+
+def notch_sos(frequency, bandwidth, sampling_rate):
+    w0 = 2*math.pi*frequency/sampling_rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0)/(2*frequency/bandwidth)
+    b = [1, -2*cos_w0, 1]
+    a = [1+alpha, -2*cos_w0, 1-alpha]
+    return [normalize_section(b, a)]
+
+
+def normalize_section(b, a):
+    return [b[0]/a[0], b[1]/a[0], b[2]/a[0], 1.0, a[1]/a[0], a[2]/a[0]]
+
+
+def design_sos(sampling_rate):
+    sections = butterworth_lowpass_sos(lowpass_order, lowpass_cutoff, sampling_rate)
+    for frequency in notch_frequencies:
+        if frequency+notch_bandwidth/2 < sampling_rate/2:
+            sections.extend(notch_sos(frequency, notch_bandwidth, sampling_rate))
+    return np.array(sections)
+
+
+class StreamingFilter:
+    """
+    Cascade of second-order sections (transposed direct form II) that keeps
+    its state between calls, so each block of new samples is filtered once.
+    """
+    def __init__(self, num_channels, sampling_rate, dtype=np.float64, sos=None):
+        self.num_channels = num_channels
+        if sos is None:
+            sos = design_sos(sampling_rate)
+        self.sos = np.asarray(sos).astype(dtype)
+        self.state = np.zeros((len(self.sos), 2, num_channels), dtype=dtype)
+        self.primed = False
+
+    def reset(self):
+        self.state.fill(0)
+        self.primed = False
+
+    def prime(self, initial_values):
+        # Steady-state initial conditions for a constant input, avoids the startup step response
+        x = np.asarray(initial_values, dtype=self.state.dtype)
+        for i, (b0, b1, b2, _, a1, a2) in enumerate(self.sos):
+            gain = (b0+b1+b2)/(1+a1+a2)
+            self.state[i, 1] = (b2-a2*gain)*x
+            self.state[i, 0] = (b1-a1*gain)*x+self.state[i, 1]
+            x = gain*x
+        self.primed = True
+
+    def process(self, block):
+        """ Filters a channel-major block of shape (num_channels, samples) """
+        output = np.array(block, dtype=self.state.dtype)
+        if output.shape[1] == 0:
+            return output
+        if not self.primed:
+            self.prime(output[:, 0])
+
+        for i, (b0, b1, b2, _, a1, a2) in enumerate(self.sos):
+            z0, z1 = self.state[i]
+            for n in range(output.shape[1]):
+                x = output[:, n]
+                y = b0*x+z0
+                z0 = b1*x-a1*y+z1
+                z1 = b2*x-a2*y
+                output[:, n] = y
+            self.state[i, 0] = z0
+            self.state[i, 1] = z1
+        return output